@@ -5,17 +5,63 @@
 
 
 import random
+import time
 from contextlib import suppress
-from dataclasses import dataclass
-from typing import Sequence, Iterator
+from datetime import date
+from typing import Optional, Sequence, Iterator
 
 from anki.cards import Card
-from anki.consts import REVLOG_RESCHED
+from anki.consts import (
+    REVLOG_RESCHED,
+    QUEUE_TYPE_SUSPENDED,
+    CARD_TYPE_REV as CARD_TYPE_REVIEWING,
+)
 from aqt import mw, gui_hooks
-from aqt.utils import tooltip
+from aqt.editor import Editor
+from aqt.operations import QueryOp
+from aqt.utils import tooltip, askUser
 from aqt.qt import QActionGroup
 
+from .applying import (
+    apply_delays_in_chunks,
+    is_applying,
+    write_delays,
+    write_delays_in_reviewer,
+    write_pending_revlog_entries,
+    revert_last_batch,
+)
+from .audit_log import delay_log, SOURCE_REVIEWER, SOURCE_SYNC, SOURCE_BATCH, SOURCE_RESCHEDULE
+from .backfill import get_card_id_to_last_review_in_range, get_range_millis
+from .backfill_dialog import BackfillDialog
+from .collisions import clear_collisions_cache
+from .collisions_dialog import CollisionsDialog
 from .delay_after_sync_dialog import DelayAfterSyncDialog
+from .delay_log_dialog import DelayLogDialog
+from .handled_notes import handled_notes
+from .stats import stats
+from .stats_dialog import StatsDialog
+from .instrumentation import counted
+from .journal import journal, Batch
+from .delaying import (
+    Delay,
+    SiblingRow,
+    calculate_new_relative_due_range,
+    calculate_new_absolute_due,
+    calculate_delay_rows,
+    clear_range_tables,
+)
+from .related_notes import related_notes
+from .reschedules import manual_reschedules
+from .sibling_index import sibling_index
+from .sweep import IdleSweep
+from .snapshot import (
+    Snapshot,
+    snapshot_table,
+    recent_snapshot_exists,
+    opened_snapshot,
+    write_snapshot,
+    delete_snapshot,
+)
 
 from .configuration import (
     Config,
@@ -26,76 +72,45 @@ from .configuration import (
 )
 
 from .tools import (
-    is_card_reviewing,
-    is_card_suspended,
-    get_card_absolute_due,
     get_anki_today,
-    get_siblings,
-    set_card_absolute_due,
+    can_have_siblings,
+    clear_can_have_siblings_cache,
+    load_delays,
     remove_card_from_current_review_queue,
     epoch_to_anki_days,
+    get_collection_genesis_datetime,
     sorted_by_value,
     checkable,
-    html_to_text_line,
+    clickable,
+    get_question_text_line,
+    clear_question_text_line_cache,
 )
 
 
-# Interval → ranges for 2; 3 cards per note:
-#    0 →    0-0;   0-0
-#    1 →    0-0;   0-0
-#    2 →    1-1;   0-0
-#    3 →    1-1;   1-1
-#    4 →    1-1;   1-1
-#    5 →    1-2;   1-1
-#    6 →    2-2;   1-1
-#    7 →    2-2;   1-2
-#    8 →    2-3;   1-2
-#    9 →    2-3;   2-2
-#   10 →    2-3;   2-2
-#   12 →    3-4;   2-3
-#   14 →    3-4;   2-3
-#   16 →    4-5;   2-3
-#   18 →    4-5;   3-4
-#   20 →    4-6;   3-4
-#   30 →    6-8;   4-5
-#   60 →  10-13;   7-9
-#   90 →  13-17;  9-11
-#  180 →  19-25; 13-17
-#  360 →  28-37; 19-24
-#  720 →  40-52; 27-35
-# 1500 →  57-74; 38-49
-# 3000 → 78-101; 52-67
-# https://www.desmos.com/calculator/fnh882qnd1
-def calculate_new_relative_due_range(interval: int, cards_per_note: int) -> (int, int):
-    f = (24.0 * interval + 310) ** 0.4 - 10
-    f = f * 2 / cards_per_note
-    return int(round(f)), int(round(f * 1.3))
-
-
-@dataclass
-class Delay:
-    sibling: Card
-    old_absolute_due: int
-    new_absolute_due: int
-
-
-def get_delays(siblings: Sequence[Card], rescheduling_day: int) -> Iterator[Delay]:
-    cards_per_note = len(siblings) + 1
-
-    for sibling in siblings:
-        if not is_card_reviewing(sibling) or is_card_suspended(sibling):
-            continue
+# Siblings are the other cards of the note, and, if enabled, the cards of related notes
+def get_sibling_and_related_rows(card_id: int) -> "list[SiblingRow]":
+    deck_ids = config.enabled_for_deck_ids
+    sibling_rows = sibling_index.get_sibling_rows(card_id, deck_ids)
+    note_id = sibling_index.card_id_to_note_id.get(card_id)
 
-        sibling_interval = sibling.ivl
-        old_absolute_due = get_card_absolute_due(sibling)
-        old_relative_due = old_absolute_due - rescheduling_day
-        new_relative_due_min, new_relative_due_max = \
-            calculate_new_relative_due_range(sibling_interval, cards_per_note)
+    if config.related_notes_field and note_id is not None:
+        for related_note_id in related_notes.get_related_note_ids(
+            note_id, config.related_notes_field, deck_ids
+        ):
+            sibling_rows = sibling_rows + sibling_index.get_note_rows(related_note_id)
+
+    return sibling_rows
 
-        if new_relative_due_min > 0 and new_relative_due_min > old_relative_due:
-            new_relative_due = random.randint(new_relative_due_min, new_relative_due_max)
-            new_absolute_due = rescheduling_day + new_relative_due
-            yield Delay(sibling, old_absolute_due, new_absolute_due)
+
+# See `SiblingRow` in `delaying.py`
+def get_delays(sibling_rows: Sequence[SiblingRow], rescheduling_day: int,
+               randint=random.randint) -> "list[Delay]":
+    return load_delays(calculate_delay_rows(
+        sibling_rows,
+        rescheduling_day=rescheduling_day,
+        randint=randint,
+        deck_id_to_curve=config.deck_id_to_delay_curve,
+    ))
 
 
 ########################################################################################
@@ -104,9 +119,9 @@ def get_delays(siblings: Sequence[Card], rescheduling_day: int) -> Iterator[Dela
 
 
 def get_delayed_message(delay: Delay):
-    question = html_to_text_line(delay.sibling.question())
+    question = get_question_text_line(delay.card_id, delay.note_id)
     today = get_anki_today()
-    interval = delay.sibling.ivl
+    interval = delay.interval
 
     return (
         f"Sibling: {question} (interval: <b>{interval}</b> days)<br>"
@@ -117,17 +132,26 @@ def get_delayed_message(delay: Delay):
 
 
 @gui_hooks.reviewer_did_show_answer.append
+@counted("show answer")
 def reviewer_did_show_answer(card: Card):
-    if not config.enabled_for_current_deck:
+    if (
+        not config.enabled_for_current_deck
+        or config.delay_at_end_of_session
+        or handled_notes.contains(card.nid)
+        or (not config.related_notes_field and not can_have_siblings(card))
+    ):
         return
 
+    handled_notes.add(card.nid)
+
     today = get_anki_today()
-    siblings = get_siblings(card)
+    sibling_rows = get_sibling_and_related_rows(card.id)
+    delays = get_delays(sibling_rows, rescheduling_day=today)
+    write_delays_in_reviewer(delays, SOURCE_REVIEWER)
     messages = []
 
-    for delay in get_delays(siblings, rescheduling_day=today):
-        set_card_absolute_due(delay.sibling, delay.new_absolute_due)
-        remove_card_from_current_review_queue(delay.sibling)
+    for delay in delays:
+        remove_card_from_current_review_queue(delay.card_id)
 
         if (
             delay.new_absolute_due - max(delay.old_absolute_due, today) >= 14
@@ -147,68 +171,197 @@ def reviewer_did_show_answer(card: Card):
 # Card id to last review time, the latter in epoch milliseconds
 IdToLastReview = "dict[int, int]"
 
+# Starting from this size, sync diff is processed as if it was brought by a full sync
+FULL_SYNC_DIFF_THRESHOLD = 20000
+
+# Starting from this many cards in the snapshot, sync diff is found in SQL,
+# unless related notes are enabled, as the SQL only looks at cards of the same note
+SQL_SYNC_DIFF_THRESHOLD = 50000
+
 
-# This receives two dictionaries:
-#   * card id to last review time (in milliseconds) before sync, and
-#   * the same after sync, *but* without any cards that have their last review
-#     done not via actual reviewing, but via user's manually choosing “Set due date…”,
-# and yields those cards that have newer reviews than the ones we recorded before sync.
+# This receives two dictionaries, card id to last review time (in milliseconds)
+# before sync and after sync, and yields those cards that have newer reviews
+# than the ones we recorded before sync. Both dictionaries leave out manual reschedules,
+# such as user's choosing “Set due date…” and the add-on's own delays,
+# so each card maps to its latest actual review.
 #
 # This also runs in case of full sync. Why? Well, why not?
+# (Full syncs, and other syncs that bring lots of reviews, are processed differently,
+# but the results are the same; see `calculate_delays_after_full_sync`.)
 # There's plenty of scenarios in which such a sync, from our point of view,
 # is indistinguishable from a regular one, for instance,
 # when user merely deletes a note type—this requires a full sync.
 # Please let me know if you think of a scenario when this is dangerous!
 #
-# You could ask, why does the `before` dictionary include manual reschedules?
+# You could ask, why does the `before` dictionary skip manual reschedules?
 # Well, imagine this scenario:
-#  * before sync, we have a card with a manual reschedule on May 8th, and
-#  * after we have the same card with a regular review on May 1st.
-# If both `before` and `after` dictionaries stripped manual reviews,
-# this card would be subject to sibling delaying.
-# It is not clear what we should be doing with such a card,
-# since the scenario a bit too crazy. So err on the side of caution and skip it.
-def calculate_sync_diff(before: IdToLastReview, after: IdToLastReview) -> IdToLastReview:
+#  * before sync, we have a card with a review on May 1st,
+#    and its delay by the add-on on May 8th, and
+#  * sync brings a review of the same card done elsewhere on May 5th.
+# If `before` included manual reschedules, the May 8th delay would hide
+# the May 5th review, and its siblings would not be delayed.
+# In turn, a manual reschedule done before sync doesn't shield the card
+# from an older review brought by sync; this is fine,
+# as delaying siblings only ever moves them further away.
+def calculate_sync_diff(before: "IdToLastReview | Snapshot",
+                        after: IdToLastReview) -> IdToLastReview:
     result = {}
 
     for card_id, last_review_after in after.items():
-        if card_id in before:
-            last_review_before = before[card_id]
-            if last_review_before >= last_review_after:
-                continue
+        last_review_before = before.get(card_id)
+        if last_review_before is not None and last_review_before >= last_review_after:
+            continue
         result[card_id] = last_review_after
 
     return result
 
 
-def calculate_delays_after_sync(sync_diff: IdToLastReview) -> Iterator[Delay]:
-    sync_diff = sorted_by_value(sync_diff)
+# After a full sync, the diff can contain most of the collection,
+# so instead of looking at each card separately, the latest review of each note
+# and the siblings of the card reviewed are found by a single query.
+# This yields the same delays as the per-card loop below.
+#
+# The query takes the diff as a subquery that selects
+# the ids of the last reviews, and the note and card ids of the reviewed cards.
+# With `skip_cards_in_diff`, the cards in the diff are never delayed themselves.
+def calculate_delays_for_diff_query(diff_query: str, seed: int = None,
+                                    skip_cards_in_diff: bool = False) -> Iterator[Delay]:
+    today = get_anki_today()
+    genesis = get_collection_genesis_datetime()
+    rng = random.Random(seed) if seed is not None else random
+
+    delay_rows = []
+    rows = mw.col.db.all(
+        f"""
+            WITH diff AS ({diff_query}),
+                 last_reviews AS
+                    (SELECT max(review_id) AS review_id FROM diff GROUP BY nid),
+                 reviewed AS
+                    (SELECT diff.* FROM diff JOIN last_reviews USING (review_id)),
+                 note_sizes AS
+                    (SELECT nid, count() AS size FROM cards
+                     WHERE nid IN (SELECT nid FROM reviewed) GROUP BY nid)
+            SELECT reviewed.review_id, siblings.id, siblings.ivl,
+                   CASE WHEN siblings.odue != 0 AND siblings.odid != 0
+                        THEN siblings.odue ELSE siblings.due END,
+                   note_sizes.size,
+                   CASE WHEN siblings.odid != 0 THEN siblings.odid ELSE siblings.did END
+            FROM reviewed
+            JOIN cards AS siblings ON siblings.nid = reviewed.nid AND siblings.id != reviewed.cid
+            JOIN note_sizes ON note_sizes.nid = reviewed.nid
+            WHERE siblings.type = {CARD_TYPE_REVIEWING}
+              AND siblings.queue != {QUEUE_TYPE_SUSPENDED}
+              {"AND siblings.id NOT IN (SELECT cid FROM diff)" if skip_cards_in_diff else ""}
+            ORDER BY reviewed.review_id DESC, siblings.id
+        """
+    )
+
+    for review_id, card_id, interval, old_absolute_due, cards_per_note, home_deck_id in rows:
+        new_absolute_due = calculate_new_absolute_due(
+            interval=interval,
+            cards_per_note=cards_per_note,
+            old_absolute_due=old_absolute_due,
+            rescheduling_day=epoch_to_anki_days(review_id / 1000, genesis),
+            randint=rng.randint,
+            curve=config.get_delay_curve(home_deck_id),
+        )
+
+        if new_absolute_due is not None and new_absolute_due > today:
+            delay_rows.append((card_id, old_absolute_due, new_absolute_due))
+
+    yield from load_delays(delay_rows)
+
+
+# Since the diff values are the ids of the last reviews,
+# they can be used to find the reviews, and the reviewed cards, in revlog
+def calculate_delays_after_full_sync(sync_diff: IdToLastReview, seed: int = None) \
+        -> Iterator[Delay]:
+    review_ids = "(" + ",".join(str(review_id) for review_id in sync_diff.values()) + ")"
+
+    yield from calculate_delays_for_diff_query(
+        f"""
+            SELECT revlog.id AS review_id, cards.nid AS nid, cards.id AS cid
+            FROM revlog JOIN cards ON cards.id = revlog.cid
+            WHERE revlog.id IN {review_ids}
+        """,
+        seed,
+    )
+
+
+# For large collections, instead of building the diff in Python,
+# the snapshot is put into a temporary table, and the diff is found by SQLite.
+# This is the same as `calculate_sync_diff` of the snapshot and the result of
+# `get_card_id_to_last_review_time(skip_manual=True)`, and only the siblings
+# to be delayed are ever loaded into Python.
+def calculate_delays_after_sync_in_sql(snapshot_table: str, seed: int = None) \
+        -> Iterator[Delay]:
+    wanted_deck_ids = "(" + ",".join(config.enabled_for_deck_ids) + ")"
+
+    yield from calculate_delays_for_diff_query(
+        f"""
+            SELECT last_reviews.id AS review_id, cards.nid AS nid, cards.id AS cid
+            FROM (SELECT cid, max(id) AS id FROM revlog
+                  WHERE cid IN (SELECT id FROM cards WHERE did IN {wanted_deck_ids})
+                    AND type != {REVLOG_RESCHED}
+                  GROUP BY cid) AS last_reviews
+            JOIN cards ON cards.id = last_reviews.cid
+            LEFT JOIN {snapshot_table} AS before ON before.cid = last_reviews.cid
+            WHERE before.last_review IS NULL OR before.last_review < last_reviews.id
+        """,
+        seed,
+    )
+
+
+# Large diffs are processed in SQL, which only looks at cards of the same note,
+# so with related notes enabled, all diffs go through the regular pass.
+# Pass `seed` to get reproducible results.
+def calculate_delays_after_sync(sync_diff: IdToLastReview, seed: int = None,
+                                full_sync: bool = False) -> Iterator[Delay]:
     today = get_anki_today()
 
+    if not config.related_notes_field and (
+        full_sync or len(sync_diff) >= FULL_SYNC_DIFF_THRESHOLD
+    ):
+        yield from calculate_delays_after_full_sync(sync_diff, seed)
+        return
+
+    rng = random.Random(seed) if seed is not None else random
+    genesis = get_collection_genesis_datetime()
+    sync_diff = sorted_by_value(sync_diff)
+
     while sync_diff:
         card_id, last_review_time = sync_diff.popitem()  # last, most recent review
-        siblings = get_siblings(mw.col.get_card(card_id))
-        last_review_day = epoch_to_anki_days(last_review_time / 1000)
-        delays = get_delays(siblings, rescheduling_day=last_review_day)
+        sibling_rows = get_sibling_and_related_rows(card_id)
+        last_review_day = epoch_to_anki_days(last_review_time / 1000, genesis)
+        delays = get_delays(sibling_rows, rescheduling_day=last_review_day,
+                            randint=rng.randint)
 
         for delay in delays:
             if delay.new_absolute_due > today:
                 yield delay
 
-        for sibling in siblings:
+        for sibling_row in sibling_rows:
             with suppress(KeyError):
-                sync_diff.pop(sibling.id)
+                sync_diff.pop(sibling_row[0])
 
 
-def perform_delay_after_sync(before: IdToLastReview, after: IdToLastReview):
-    sync_diff = calculate_sync_diff(before, after)
-    delays = list(calculate_delays_after_sync(sync_diff))
+# Returns the `on_finished` callback for `apply_delays_in_chunks` that tells user how it went
+def get_on_delays_applied(total: int):
+    def on_delays_applied(applied: int, cancelled: bool, elapsed: float):
+        if cancelled:
+            message = f"Cancelled; {applied} of {total} cards rescheduled"
+        else:
+            message = f"{applied} cards rescheduled"
+        tooltip(f"<span style='color: green'>{message} in {elapsed:.1f} s</span>")
+
+    return on_delays_applied
+
 
+def offer_delays_after_sync(delays: "list[Delay]"):
     if delays:
         def apply_delays():
-            for delay in delays:
-                set_card_absolute_due(delay.sibling, delay.new_absolute_due)
-            tooltip(f"<span style='color: green'>{len(delays)} cards rescheduled</span>")
+            apply_delays_in_chunks(delays, source=SOURCE_SYNC,
+                                   on_finished=get_on_delays_applied(len(delays)))
 
         if config.delay_after_sync == DELAY_WITHOUT_ASKING:
             apply_delays()
@@ -216,46 +369,233 @@ def perform_delay_after_sync(before: IdToLastReview, after: IdToLastReview):
             DelayAfterSyncDialog(delays=delays, on_accepted=apply_delays).show()
 
 
+@counted("delay after sync")
+def perform_delay_after_sync(before: "IdToLastReview | Snapshot", after: IdToLastReview,
+                             full_sync: bool = False):
+    sync_diff = calculate_sync_diff(before, after)
+    offer_delays_after_sync(list(calculate_delays_after_sync(sync_diff, full_sync=full_sync)))
+
+
+@counted("delay after sync in SQL")
+def perform_delay_after_sync_in_sql(before: Snapshot):
+    with snapshot_table(before) as table:
+        offer_delays_after_sync(list(calculate_delays_after_sync_in_sql(table)))
+
+
 ########################################################################################
 
 
-def get_card_id_to_last_review_time(skip_manual: bool) -> IdToLastReview:
-    wanted_deck_ids = "(" + ",".join(config.enabled_for_deck_ids) + ")"
+# With `skip_manual`, manual reschedules, including the add-on's own delays,
+# are not reviews, and the last review is the latest of the other revlog entries.
+# If `note_ids` are given, looks at the cards of these notes instead of enabled decks
+def get_card_id_to_last_review_time(skip_manual: bool, note_ids: Sequence[int] = None) \
+        -> IdToLastReview:
+    if note_ids is None:
+        wanted_deck_ids = "(" + ",".join(config.enabled_for_deck_ids) + ")"
+        wanted_cards_condition = f"did IN {wanted_deck_ids}"
+    else:
+        wanted_cards_condition = "nid IN (" + ",".join(str(note_id) for note_id in note_ids) + ")"
 
     return dict(mw.col.db.all(  # noqa
         f"""
             WITH wanted_cards AS 
-                    (SELECT id FROM cards WHERE did IN {wanted_deck_ids}),
-                 wanted_revlog_ids AS 
-                    (SELECT max(id) FROM revlog WHERE cid IN wanted_cards GROUP BY cid)
-            SELECT cid, id FROM revlog
-            WHERE id IN wanted_revlog_ids AND type != {REVLOG_RESCHED}
+                (SELECT id FROM cards WHERE {wanted_cards_condition})
+            SELECT cid, max(id) FROM revlog
+            WHERE cid IN wanted_cards AND type != {REVLOG_RESCHED} GROUP BY cid
         """ if skip_manual else f"""
             WITH wanted_cards AS 
-                (SELECT id FROM cards WHERE did IN {wanted_deck_ids})
+                (SELECT id FROM cards WHERE {wanted_cards_condition})
             SELECT cid, max(id) FROM revlog
             WHERE cid IN wanted_cards GROUP BY cid
         """
     ))
 
 
-id_to_last_review_before: IdToLastReview = {}
+# The snapshot skips manual reschedules too, so that a review brought by sync
+# is not hidden by a delay that the add-on applied to the card locally in the meantime.
+# If a recent snapshot is still there when sync starts, the previous sync didn't finish.
+# That snapshot tells more about the state before the sync that brought new reviews
+# than anything we can take now, so keep it.
+# Full download replaces the database of the collection, so if the database
+# is not the one we saw before sync, we know it was a full sync
+database_before_sync = None
 
 
 @gui_hooks.sync_will_start.append
 def sync_will_start():
+    global database_before_sync
+    database_before_sync = mw.col.db
+    write_pending_revlog_entries()
+
     if config.delay_after_sync in [DELAY_WITHOUT_ASKING, ASK_EVERY_TIME]:
-        global id_to_last_review_before
-        id_to_last_review_before = get_card_id_to_last_review_time(skip_manual=False)
+        if not recent_snapshot_exists():
+            write_snapshot(get_card_id_to_last_review_time(skip_manual=True))
 
 
 @gui_hooks.sync_did_finish.append
 def sync_did_finish():
+    global database_before_sync
+    sibling_index.invalidate()
+    related_notes.invalidate()
+    clear_collisions_cache()
+
+    full_sync = database_before_sync is not None and database_before_sync is not mw.col.db
+    database_before_sync = None
+
     if config.delay_after_sync in [DELAY_WITHOUT_ASKING, ASK_EVERY_TIME]:
-        global id_to_last_review_before
-        id_to_last_review_after = get_card_id_to_last_review_time(skip_manual=True)
-        perform_delay_after_sync(id_to_last_review_before, id_to_last_review_after)
-        id_to_last_review_before = {}
+        with opened_snapshot() as id_to_last_review_before:
+            if id_to_last_review_before is None:
+                pass
+            elif (
+                id_to_last_review_before.count >= SQL_SYNC_DIFF_THRESHOLD
+                and not config.related_notes_field
+            ):
+                perform_delay_after_sync_in_sql(id_to_last_review_before)
+            else:
+                id_to_last_review_after = get_card_id_to_last_review_time(skip_manual=True)
+                perform_delay_after_sync(id_to_last_review_before, id_to_last_review_after,
+                                         full_sync=full_sync)
+        delete_snapshot()
+
+    # Reschedules brought by sync are handled above, or skipped like other synced reviews
+    manual_reschedules.start()
+
+
+########################################################################################
+############################################################################ idle sweep
+########################################################################################
+
+
+# Treats the latest reviews of the notes as if they were brought by sync.
+# Used by the idle sweep and at the end of review session
+def calculate_delays_for_notes(note_ids: Sequence[int]) -> "list[Delay]":
+    card_id_to_last_review = get_card_id_to_last_review_time(skip_manual=True,
+                                                             note_ids=note_ids)
+    return list(calculate_delays_after_sync(card_id_to_last_review))
+
+
+# A pass of the sweep processes a few notes at a time, but is journaled as one batch,
+# so that a few idle minutes don't push other batches out of the journal.
+# If the batch was reverted, or pushed out anyway, the rest of the pass gets a new one
+sweep_batch: Optional[Batch] = None
+
+
+def delay_siblings_of_swept_notes(note_ids: Sequence[int]):
+    global sweep_batch
+    if sweep_batch is None or (len(sweep_batch) and sweep_batch not in journal.batches):
+        sweep_batch = Batch(SOURCE_BATCH)
+    write_delays(calculate_delays_for_notes(note_ids), SOURCE_BATCH, sweep_batch)
+
+
+def finish_sweep_batch():
+    global sweep_batch
+    sweep_batch = None
+
+
+idle_sweep = IdleSweep(
+    get_deck_ids=lambda: config.enabled_for_deck_ids,
+    get_milliseconds_per_tick=lambda: config.idle_sweep_milliseconds_per_tick,
+    process_notes=delay_siblings_of_swept_notes,
+    on_pass_completed=finish_sweep_batch,
+    is_busy=is_applying,
+)
+
+
+def start_or_stop_idle_sweep():
+    if config.idle_sweep and mw.col is not None and mw.state != "review":
+        idle_sweep.start()
+    else:
+        idle_sweep.stop()
+
+
+########################################################################################
+######################################################################## end of session
+########################################################################################
+
+
+# In this mode, answering cards only records their notes,
+# and siblings are delayed all at once when user leaves the reviewer, or closes profile.
+# Siblings due today can still be shown in the same session.
+# The delays are written like the reviewer writes them, so that the last answer
+# can still be undone from the overview.
+session_note_ids: "set[int]" = set()
+
+
+def delay_siblings_of_session_notes():
+    if session_note_ids and mw.col is not None:
+        note_ids = sorted(session_note_ids)
+        session_note_ids.clear()
+        delays = calculate_delays_for_notes(note_ids)
+        write_delays_in_reviewer(delays, SOURCE_BATCH)
+
+        if delays and not config.quiet:
+            tooltip(f"<span style='color: green'>{len(delays)} siblings delayed</span>")
+
+
+########################################################################################
+################################################################### manual reschedules
+########################################################################################
+
+
+# After “Set due date”, “Forget” and such, each rescheduled card is treated
+# as if it was reviewed at the time, and its siblings are delayed in one write.
+# The rescheduled cards themselves are left where user put them.
+def delay_siblings_of_manually_rescheduled_cards():
+    diff_query = manual_reschedules.take_diff_query(config.enabled_for_deck_ids)
+    if diff_query is None:
+        return
+
+    if config.related_notes_field:
+        sync_diff = {card_id: review_id for review_id, _note_id, card_id
+                     in mw.col.db.all(diff_query)}
+        delays = [delay for delay in calculate_delays_after_sync(sync_diff)
+                  if delay.card_id not in sync_diff]
+    else:
+        delays = list(calculate_delays_for_diff_query(diff_query, skip_cards_in_diff=True))
+
+    if delays:
+        write_delays(delays, SOURCE_RESCHEDULE)
+
+        if not config.quiet:
+            tooltip(f"<span style='color: green'>{len(delays)} siblings delayed</span>")
+
+
+########################################################################################
+############################################################################### backfill
+########################################################################################
+
+
+# A range can hold many thousands of reviews, so the delays are computed in background,
+# with progress shown; the collection is only read until user accepts the delays
+def perform_backfill(start_date: date, end_date: date):
+    def calculate_delays(_col) -> "list[Delay]":
+        start_millis, end_millis = get_range_millis(start_date, end_date)
+        sync_diff = get_card_id_to_last_review_in_range(config.enabled_for_deck_ids,
+                                                        start_millis, end_millis)
+        return list(calculate_delays_after_sync(sync_diff))
+
+    QueryOp(
+        parent=mw,
+        op=calculate_delays,
+        success=lambda delays: offer_backfill_delays(delays, start_date, end_date),
+    ).with_progress("Looking for siblings to delay…").run_in_background()
+
+
+def offer_backfill_delays(delays: "list[Delay]", start_date: date, end_date: date):
+    if not delays:
+        tooltip("No siblings to delay")
+        return
+
+    def apply_delays():
+        apply_delays_in_chunks(delays, source=SOURCE_BATCH,
+                               on_finished=get_on_delays_applied(len(delays)))
+
+    DelayAfterSyncDialog(
+        delays=delays,
+        on_accepted=apply_delays,
+        message=f"I found {len(delays)} siblings that would have been delayed "
+                f"by the reviews done between {start_date} and {end_date}. Delay now?",
+    ).show()
 
 
 ########################################################################################
@@ -276,6 +616,13 @@ def set_quiet(checked):
 def set_delay_after_sync(value):
     config.delay_after_sync = value
 
+def set_delay_at_end_of_session(checked):
+    config.delay_at_end_of_session = checked
+
+def set_idle_sweep(checked):
+    config.idle_sweep = checked
+    start_or_stop_idle_sweep()
+
 
 menu_enabled_for_this_deck = checkable(
     title="Enable sibling delaying for this deck",
@@ -302,6 +649,54 @@ menu_do_not_delay = checkable(
     on_click=lambda _checked: set_delay_after_sync(DO_NOT_DELAY)
 )
 
+menu_delay_at_end_of_session = checkable(
+    title="Delay siblings when leaving the reviewer, rather than after every answer",
+    on_click=set_delay_at_end_of_session
+)
+
+menu_idle_sweep = checkable(
+    title="Delay siblings in the background while Anki is idle",
+    on_click=set_idle_sweep
+)
+
+menu_backfill = clickable(
+    title="Delay siblings retroactively…",
+    on_click=lambda: BackfillDialog(on_accepted=perform_backfill).show()
+)
+
+def revert_last_batch_of_delays():
+    batch = journal.get_last_batch()
+
+    if batch is None:
+        tooltip("Nothing to revert")
+    elif askUser(f"Revert the last {len(batch)} delays, made by {batch.source} "
+                 f"at {time.strftime('%H:%M', time.localtime(batch.time))}? "
+                 f"Cards rescheduled since will be left as they are.",
+                 title="Delay siblings"):
+        reverted, skipped = revert_last_batch()
+        tooltip(f"{reverted} cards reverted" + (f", {skipped} skipped" if skipped else ""))
+
+
+menu_revert_last_batch = clickable(
+    title="Revert last batch of delays…",
+    on_click=revert_last_batch_of_delays
+)
+
+menu_show_delay_log = clickable(
+    title="Show delay log…",
+    on_click=lambda: DelayLogDialog().show()
+)
+
+menu_show_stats = clickable(
+    title="Show statistics…",
+    on_click=lambda: StatsDialog().show()
+)
+
+menu_show_collisions = clickable(
+    title="Show sibling collisions…",
+    on_click=lambda: CollisionsDialog(config.enabled_for_deck_ids, config.get_delay_curve).show()
+)
+
 delay_after_sync_group = QActionGroup(mw)
 delay_after_sync_group.addAction(menu_delay_without_asking)
 delay_after_sync_group.addAction(menu_ask_every_time)
@@ -311,10 +706,19 @@ mw.form.menuTools.addSeparator()
 mw.form.menuTools.addAction(menu_enabled_for_this_deck)
 menu_for_all_decks = mw.form.menuTools.addMenu("For all decks")
 menu_for_all_decks.addAction(menu_quiet)
+menu_for_all_decks.addAction(menu_delay_at_end_of_session)
 menu_for_all_decks.addSeparator()
 menu_for_all_decks.addAction(menu_delay_without_asking)
 menu_for_all_decks.addAction(menu_ask_every_time)
 menu_for_all_decks.addAction(menu_do_not_delay)
+menu_for_all_decks.addSeparator()
+menu_for_all_decks.addAction(menu_idle_sweep)
+menu_for_all_decks.addAction(menu_backfill)
+menu_for_all_decks.addAction(menu_revert_last_batch)
+menu_for_all_decks.addSeparator()
+menu_for_all_decks.addAction(menu_show_delay_log)
+menu_for_all_decks.addAction(menu_show_stats)
+menu_for_all_decks.addAction(menu_show_collisions)
 
 
 def adjust_menu():
@@ -322,17 +726,88 @@ def adjust_menu():
         menu_enabled_for_this_deck.setEnabled(mw.state in ["overview", "review"])
         menu_enabled_for_this_deck.setChecked(config.enabled_for_current_deck)
         menu_quiet.setChecked(config.quiet)
+        menu_delay_at_end_of_session.setChecked(config.delay_at_end_of_session)
         menu_delay_without_asking.setChecked(config.delay_after_sync == DELAY_WITHOUT_ASKING)
         menu_ask_every_time.setChecked(config.delay_after_sync == ASK_EVERY_TIME)
         menu_do_not_delay.setChecked(config.delay_after_sync == DO_NOT_DELAY)
+        menu_idle_sweep.setChecked(config.idle_sweep)
 
 
 @gui_hooks.state_did_change.append
-def state_did_change(_next_state, _previous_state):
+def state_did_change(next_state, previous_state):
     adjust_menu()
+    start_or_stop_idle_sweep()
+
+    if previous_state == "review" and next_state != "review":
+        delay_siblings_of_session_notes()
+        handled_notes.save()
+
+
+@gui_hooks.profile_did_open.append
+def profile_did_open():
+    sibling_index.build(config.enabled_for_deck_ids)
+    manual_reschedules.start()
+    start_or_stop_idle_sweep()
+
+
+@gui_hooks.reviewer_did_answer_card.append
+def reviewer_did_answer_card(_reviewer, card: Card, _ease):
+    sibling_index.reload_card_note(card.id)
+    clear_collisions_cache()  # answers under the v2 scheduler aren't operations
+
+    if config.delay_at_end_of_session and config.enabled_for_current_deck:
+        session_note_ids.add(card.nid)
+
+
+# Operations done by the reviewer only affect the current card or its note.
+# Registered without a decorator, so that the function can still be called directly
+def operation_did_execute(changes, handler):
+    if handler is mw.reviewer and mw.reviewer.card is not None:
+        sibling_index.reload_card_note(mw.reviewer.card.id)
+    elif changes.card or changes.deck or changes.notetype:
+        sibling_index.invalidate()
 
+    if isinstance(handler, Editor) and handler.note is not None and handler.note.id:
+        related_notes.reload_note(handler.note.id)
+    elif changes.note_text or changes.deck or changes.notetype:
+        related_notes.invalidate()
 
+    if changes.notetype:
+        clear_can_have_siblings_cache()
+
+    if changes.card:
+        clear_collisions_cache()
+
+    if changes.card and handler is not mw.reviewer:
+        delay_siblings_of_manually_rescheduled_cards()
+
+gui_hooks.operation_did_execute.append(operation_did_execute)
+
+
+@gui_hooks.profile_will_close.append
+def profile_will_close():
+    delay_siblings_of_session_notes()
+    write_pending_revlog_entries()
+    idle_sweep.stop()
+    manual_reschedules.stop()
+    journal.clear()
+    finish_sweep_batch()
+    handled_notes.close()
+    config.save_now_if_pending()
+    clear_question_text_line_cache()
+    clear_can_have_siblings_cache()
+    clear_collisions_cache()
+    delay_log.close()
+    stats.close()
+    sibling_index.invalidate()
+    related_notes.invalidate()
+
+
+# We don't need to do anything if the config that was just written
+# is the same as the one we've got, e.g. if we wrote it ourselves
 @run_on_configuration_change
 def configuration_changed():
-    config.load()
-    adjust_menu()
+    if config.load():
+        clear_range_tables()
+        adjust_menu()
+        start_or_stop_idle_sweep()
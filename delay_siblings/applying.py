@@ -0,0 +1,177 @@
+# Applying thousands of delays at once would freeze Anki for a while,
+# so large batches are applied in chunks, in between which we return to the event loop.
+# Each chunk is written in one go, so if user cancels,
+# the chunks that were applied stay applied, and the rest are not touched.
+
+import time
+from typing import Callable, Optional, Sequence
+
+from aqt import mw
+from aqt.qt import QProgressDialog, QTimer, Qt
+
+from .audit_log import delay_log, SOURCE_REVERT
+from .collisions import clear_collisions_cache
+from .delaying import Delay
+from .instrumentation import counted
+from .journal import Batch, journal
+from .reschedules import manual_reschedules
+from .sibling_index import sibling_index
+from .stats import stats
+from .tools import (
+    set_cards_absolute_due,
+    set_cards_absolute_due_via_backend,
+    log_cards_rescheduled,
+    load_delays,
+)
+
+
+APPLY_CHUNK_SIZE = 500
+
+
+# To be called after the delays were written.
+# `source` is one of the `SOURCE_*` constants of `audit_log`
+def record_delays(delays: Sequence[Delay], source: str):
+    for delay in delays:
+        sibling_index.set_card_absolute_due(delay.card_id, delay.new_absolute_due)
+    delay_log.log_delays(delays, source)
+    stats.count_delays(delays)
+    clear_collisions_cache()
+
+
+# The delays are also logged in revlog, in the same transaction as the new dues.
+# Unless `batch` is given, the delays are journaled as a separate batch
+@counted("write delays")
+def write_delays(delays: Sequence[Delay], source: str, batch: Optional[Batch] = None):
+    set_cards_absolute_due(
+        (delay.card_id, delay.new_absolute_due, delay.in_filtered_deck)
+        for delay in delays
+    )
+    manual_reschedules.add_own_revlog_ids(
+        log_cards_rescheduled(delay.card_id for delay in delays)
+    )
+    record_delays(delays, source)
+    journal.record(delays, batch or Batch(source))
+
+
+# Writing to the database directly makes Anki throw away its undo queue,
+# so the reviewer, that only delays a card or two at a time, and the end of session
+# write them through the backend, as user may want to undo their last answer.
+# For the same reason, the revlog entries of these delays are written later,
+# all at once, before sync or when the profile is closed, where the undo queue
+# is thrown away anyway; see `write_pending_revlog_entries`.
+pending_revlog_card_ids: "list[int]" = []
+
+@counted("write delays in reviewer")
+def write_delays_in_reviewer(delays: Sequence[Delay], source: str):
+    set_cards_absolute_due_via_backend(
+        (delay.card_id, delay.new_absolute_due)
+        for delay in delays
+    )
+    pending_revlog_card_ids.extend(delay.card_id for delay in delays)
+    record_delays(delays, source)
+    journal.record(delays, Batch(source))
+
+
+def write_pending_revlog_entries():
+    if pending_revlog_card_ids:
+        manual_reschedules.add_own_revlog_ids(log_cards_rescheduled(pending_revlog_card_ids))
+        pending_revlog_card_ids.clear()
+
+
+# The number of chunked applies that are still going on, see `is_applying`
+applies_in_progress = 0
+
+
+# Other writers, such as the idle sweep, should wait until the chunks are all applied,
+# as control returns to the event loop in between them
+def is_applying() -> bool:
+    return applies_in_progress > 0
+
+
+# Calls `on_finished(number of delays applied, whether cancelled, seconds elapsed)`.
+# Batches that fit in a single chunk are applied right away, without progress dialog.
+# All chunks are journaled as one batch.
+def apply_delays_in_chunks(delays: Sequence[Delay], source: str,
+                           on_finished: Callable[[int, bool, float], None]):
+    started_at = time.monotonic()
+
+    if len(delays) <= APPLY_CHUNK_SIZE:
+        write_delays(delays, source)
+        on_finished(len(delays), False, time.monotonic() - started_at)
+        return
+
+    progress = QProgressDialog("Delaying siblings…", "Cancel", 0, len(delays), mw)
+    progress.setWindowTitle("Delay siblings")
+    progress.setWindowModality(Qt.WindowModality.WindowModal)
+    progress.setMinimumDuration(0)
+    progress.setAutoClose(False)
+    progress.setAutoReset(False)
+    progress.show()
+
+    global applies_in_progress
+    applies_in_progress += 1
+    batch = Batch(source)
+    applied = 0
+
+    def apply_next_chunk():
+        global applies_in_progress
+        nonlocal applied
+
+        cancelled = progress.wasCanceled()
+        if cancelled or applied == len(delays):
+            applies_in_progress -= 1
+            progress.close()
+            progress.deleteLater()
+            on_finished(applied, cancelled, time.monotonic() - started_at)
+            return
+
+        chunk = delays[applied:applied + APPLY_CHUNK_SIZE]
+        write_delays(chunk, source, batch)
+        applied += len(chunk)
+        progress.setValue(applied)
+
+        QTimer.singleShot(0, apply_next_chunk)
+
+    QTimer.singleShot(0, apply_next_chunk)
+
+
+########################################################################################
+
+
+# Reverts the delays of the last journaled batch, in one go,
+# except for the cards whose due was changed since by anything else.
+# Returns the numbers of reverted and skipped cards
+def revert_last_batch() -> (int, int):
+    batch = journal.pop_last_batch()
+    if batch is None:
+        return 0, 0
+
+    card_ids = "(" + ",".join(str(card_id) for card_id, _, _, _ in batch) + ")"
+    card_id_to_absolute_due = dict(mw.col.db.all(
+        f"""
+            SELECT id, CASE WHEN odue != 0 AND odid != 0 THEN odue ELSE due END
+            FROM cards WHERE id IN {card_ids}
+        """
+    ))
+
+    # these go from the due after the delay back to the due before it
+    reverts = load_delays([
+        (card_id, new_absolute_due, old_absolute_due)
+        for card_id, old_absolute_due, new_absolute_due, _ in batch
+        if card_id_to_absolute_due.get(card_id) == new_absolute_due
+    ])
+
+    set_cards_absolute_due(
+        (revert.card_id, revert.new_absolute_due, revert.in_filtered_deck)
+        for revert in reverts
+    )
+    manual_reschedules.add_own_revlog_ids(
+        log_cards_rescheduled(revert.card_id for revert in reverts)
+    )
+    for revert in reverts:
+        sibling_index.set_card_absolute_due(revert.card_id, revert.new_absolute_due)
+    delay_log.log_delays(reverts, SOURCE_REVERT)
+    stats.uncount_delays(reverts, applied_at=batch.time)
+    clear_collisions_cache()
+
+    return len(reverts), len(batch) - len(reverts)
@@ -0,0 +1,142 @@
+# A log of every delay the add-on applied, kept in an SQLite database in user_files,
+# one for each profile, as the card ids of different collections have nothing in common.
+#
+# Delays are not written right away, but are collected and written in batches,
+# either after a short quiet period, or when many have accumulated, or on profile close.
+# When the log grows larger than MAX_LOG_SIZE_BYTES, it is moved aside,
+# replacing the previous old log, and a new log is started.
+#
+# The log is indexed by card id and by time. It is read page by page,
+# with the pages going back in time; see `DelayLogDialog`.
+
+import os
+import sqlite3
+import time
+from contextlib import suppress
+from typing import Sequence, Optional
+
+from aqt import mw
+from aqt.qt import QTimer, qconnect
+
+from .delaying import Delay
+from .tools import get_user_files_path
+
+
+LOG_FILENAME_FORMAT = "delay_log.{profile}.sqlite"
+OLD_LOG_FILENAME_FORMAT = "delay_log.{profile}.old.sqlite"
+
+MAX_LOG_SIZE_BYTES = 16 * 1024 * 1024
+WRITE_DELAY_MILLISECONDS = 2000
+MAX_PENDING_ROWS = 1000
+PAGE_SIZE = 100
+
+SOURCE_REVIEWER = "reviewer"
+SOURCE_SYNC = "sync"
+SOURCE_BATCH = "batch"
+SOURCE_REVERT = "revert"
+SOURCE_RESCHEDULE = "reschedule"
+
+# id, time in epoch milliseconds, card id, note id, old absolute due, new absolute due, source
+LogRow = "tuple[int, int, int, int, int, int, str]"
+
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS delays (
+        id INTEGER PRIMARY KEY,
+        time INTEGER NOT NULL,
+        card_id INTEGER NOT NULL,
+        note_id INTEGER NOT NULL,
+        old_due INTEGER NOT NULL,
+        new_due INTEGER NOT NULL,
+        source TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS delays_card_id ON delays (card_id, id);
+    CREATE INDEX IF NOT EXISTS delays_time ON delays (time);
+"""
+
+
+class DelayLog:
+    def __init__(self):
+        self.connection = None
+        self.pending_rows = []
+        self.write_timer = QTimer(mw)
+        self.write_timer.setSingleShot(True)
+        qconnect(self.write_timer.timeout, self.write_pending_rows)
+
+    def get_path(self, filename_format: str = LOG_FILENAME_FORMAT) -> str:
+        return get_user_files_path(filename_format.format(profile=mw.pm.name))
+
+    def get_connection(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.get_path())
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def close(self):
+        self.write_pending_rows()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def log_delays(self, delays: Sequence[Delay], source: str):
+        if not delays:
+            return
+
+        now = int(time.time() * 1000)
+        self.pending_rows.extend(
+            (now, delay.card_id, delay.note_id,
+             delay.old_absolute_due, delay.new_absolute_due, source)
+            for delay in delays
+        )
+
+        if len(self.pending_rows) >= MAX_PENDING_ROWS:
+            self.write_pending_rows()
+        else:
+            self.write_timer.start(WRITE_DELAY_MILLISECONDS)
+
+    def write_pending_rows(self):
+        self.write_timer.stop()
+        if not self.pending_rows:
+            return
+
+        self.rotate_if_too_large()
+        with self.get_connection() as connection:
+            connection.executemany(
+                "INSERT INTO delays (time, card_id, note_id, old_due, new_due, source) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self.pending_rows,
+            )
+        self.pending_rows = []
+
+    def rotate_if_too_large(self):
+        path = self.get_path()
+
+        with suppress(OSError):
+            if os.path.getsize(path) > MAX_LOG_SIZE_BYTES:
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+                os.replace(path, self.get_path(OLD_LOG_FILENAME_FORMAT))
+
+    # Returns up to PAGE_SIZE rows, newest first, that are older than `before_id`
+    def get_page(self, before_id: Optional[int] = None,
+                 card_id: Optional[int] = None) -> Sequence[LogRow]:
+        self.write_pending_rows()
+        conditions, parameters = [], []
+
+        if before_id is not None:
+            conditions.append("id < ?")
+            parameters.append(before_id)
+        if card_id is not None:
+            conditions.append("card_id = ?")
+            parameters.append(card_id)
+
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        return self.get_connection().execute(
+            f"SELECT id, time, card_id, note_id, old_due, new_due, source FROM delays "
+            f"{where} ORDER BY id DESC LIMIT {PAGE_SIZE}",
+            parameters,
+        ).fetchall()
+
+
+delay_log = DelayLog()
@@ -0,0 +1,60 @@
+# When sibling delaying is enabled on a deck, the reviews done before that
+# never delayed anything. Backfill replays the rule over the reviews done in a date range:
+# for each note, the latest review in the range is taken as if it was brought by sync,
+# and the resulting delays can be previewed before applying them.
+#
+# Revlog can have millions of rows, so it is read in pages, ordered by review id,
+# and only the latest review of each note is kept. Manual reschedules are skipped.
+
+from datetime import date, datetime, timedelta
+from typing import Sequence
+
+from anki.consts import REVLOG_RESCHED
+from aqt import mw
+
+from .tools import get_collection_genesis_datetime
+
+
+REVLOG_PAGE_SIZE = 10000
+
+
+# Returns card id to last review time for the last reviewed card of each note,
+# same as what `calculate_sync_diff` returns
+def get_card_id_to_last_review_in_range(deck_ids: Sequence[str], start_millis: int,
+                                        end_millis: int) -> "dict[int, int]":
+    wanted_deck_ids = "(" + ",".join(deck_ids) + ")"
+    note_id_to_last_review = {}  # note id to (review id, card id)
+    last_review_id = start_millis - 1
+
+    while True:
+        rows = mw.col.db.all(
+            f"""
+                SELECT revlog.id, revlog.cid, cards.nid
+                FROM revlog JOIN cards ON cards.id = revlog.cid
+                WHERE revlog.id > ? AND revlog.id < ? AND revlog.type != {REVLOG_RESCHED}
+                  AND (cards.did IN {wanted_deck_ids} OR cards.odid IN {wanted_deck_ids})
+                ORDER BY revlog.id
+                LIMIT {REVLOG_PAGE_SIZE}
+            """,
+            last_review_id,
+            end_millis,
+        )
+
+        # as the rows are ordered, later reviews simply replace the earlier ones
+        for review_id, card_id, note_id in rows:
+            note_id_to_last_review[note_id] = review_id, card_id
+
+        if len(rows) < REVLOG_PAGE_SIZE:
+            break
+
+        last_review_id = rows[-1][0]
+
+    return {card_id: review_id for review_id, card_id in note_id_to_last_review.values()}
+
+
+# The dates are in local time; days start at the hour of “Next day starts at”
+def get_range_millis(start_date: date, end_date: date) -> (int, int):
+    day_start = get_collection_genesis_datetime().time()
+    start = datetime.combine(start_date, day_start)
+    end = datetime.combine(end_date + timedelta(days=1), day_start)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
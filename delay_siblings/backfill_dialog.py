@@ -0,0 +1,55 @@
+from datetime import date
+from typing import Callable
+
+import aqt
+from aqt.qt import (
+    QDialog,
+    QVBoxLayout,
+    QFormLayout,
+    QDialogButtonBox,
+    QDateEdit,
+    QDate,
+    QLabel,
+    qconnect,
+)
+
+
+# noinspection PyAttributeOutsideInit
+class BackfillDialog(QDialog):
+    def __init__(self, on_accepted: Callable[[date, date], None]):
+        super().__init__(aqt.mw)  # noqa
+        aqt.mw.garbage_collect_on_dialog_finish(self)
+        self.setWindowTitle("Delay siblings retroactively")
+        self.on_accepted = on_accepted
+        self.create_interface()
+
+    def create_interface(self):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(12, 12, 12, 12)
+        layout.setSpacing(12)
+
+        label = QLabel("Find siblings that would have been delayed "
+                       "by the reviews done in the decks with sibling delaying enabled "
+                       "between these dates. You'll see them before they are delayed.", self)
+        label.setWordWrap(True)
+        layout.addWidget(label)  # noqa
+
+        today = QDate.currentDate()
+        self.start_date_edit = QDateEdit(today.addYears(-1), self)
+        self.end_date_edit = QDateEdit(today, self)
+        form = QFormLayout()
+        for title, date_edit in [("From", self.start_date_edit), ("To", self.end_date_edit)]:
+            date_edit.setCalendarPopup(True)
+            form.addRow(title, date_edit)
+        layout.addLayout(form)  # noqa
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok |
+                                      QDialogButtonBox.StandardButton.Cancel, self)
+        qconnect(button_box.accepted, self.accept)
+        qconnect(button_box.rejected, self.reject)
+        layout.addWidget(button_box)  # noqa
+
+    def accept(self):
+        super().accept()
+        self.on_accepted(self.start_date_edit.date().toPyDate(),
+                         self.end_date_edit.date().toPyDate())
@@ -0,0 +1,131 @@
+# How clumped the siblings are: for each enabled deck, a histogram of the gaps
+# between the due days of review siblings, and the number of notes that have
+# a sibling due sooner after another sibling than the add-on would allow.
+#
+# Both are computed by a single aggregate query per deck. The minimums allowed
+# by the deck's delay curve are passed to the query as a small table of interval runs,
+# taken from the same table `calculate_new_relative_due_range` uses.
+# For simplicity, notes with more than `MAX_CARDS_PER_NOTE` cards are treated
+# as if they had that many, and intervals longer than the table as its longest one.
+#
+# The results are cached until cards change: the add-on clears the cache
+# when it applies or reverts delays, after operations that change cards,
+# after answers, which under the v2 scheduler are not operations, and after sync.
+
+from typing import NamedTuple
+
+from anki.consts import QUEUE_TYPE_SUSPENDED, CARD_TYPE_REV as CARD_TYPE_REVIEWING
+from aqt import mw
+
+from .delaying import DelayCurve, MAX_TABULATED_INTERVAL, get_range_table
+
+
+MAX_CARDS_PER_NOTE = 10
+MAX_GAP = 60
+
+# Lowest and highest gap in days, label
+GAP_BUCKETS = [
+    (0, 0, "0"),
+    (1, 1, "1"),
+    (2, 2, "2"),
+    (3, 6, "3–6"),
+    (7, 13, "7–13"),
+    (14, 29, "14–29"),
+    (30, MAX_GAP - 1, f"30–{MAX_GAP - 1}"),
+    (MAX_GAP, MAX_GAP, f"{MAX_GAP}+"),
+]
+
+
+class Collisions(NamedTuple):
+    gap_counts: "list[int]"  # number of sibling pairs in each of `GAP_BUCKETS`
+    notes_too_close: int
+
+
+# The highest interval of the last run, which covers intervals past the end of the table
+LONGEST_INTERVAL = 2 ** 31 - 1
+
+
+# Cards per note, lowest interval, highest interval, minimum gap
+def get_minimum_gap_runs(curve: DelayCurve) -> "list[tuple[int, int, int, int]]":
+    runs = []
+
+    for cards_per_note in range(2, MAX_CARDS_PER_NOTE + 1):
+        minimums, _ = get_range_table(curve, cards_per_note)
+        run_start = 0
+        for interval in range(1, MAX_TABULATED_INTERVAL + 1):
+            if minimums[interval] != minimums[run_start]:
+                runs.append((cards_per_note, run_start, interval - 1, minimums[run_start]))
+                run_start = interval
+        runs.append((cards_per_note, run_start, LONGEST_INTERVAL, minimums[run_start]))
+
+    return runs
+
+
+def query_collisions(deck_id: int, curve: DelayCurve) -> Collisions:
+    runs = ",".join(f"({a},{b},{c},{d})" for a, b, c, d in get_minimum_gap_runs(curve))
+
+    # Each pair of siblings is counted once, with the interval of the sibling due later,
+    # as that's the one the add-on would delay when the other one is reviewed
+    rows = mw.col.db.all(
+        f"""
+            WITH minimum_gaps(cards_per_note, low, high, minimum_gap) AS (VALUES {runs}),
+                 siblings AS
+                    (SELECT id, nid, ivl,
+                            CASE WHEN odue != 0 AND odid != 0 THEN odue ELSE due END AS due
+                     FROM cards
+                     WHERE type = {CARD_TYPE_REVIEWING} AND queue != {QUEUE_TYPE_SUSPENDED}
+                       AND nid IN (SELECT nid FROM cards WHERE did = ? OR odid = ?)),
+                 note_sizes AS
+                    (SELECT nid, min(count(), {MAX_CARDS_PER_NOTE}) AS cards_per_note
+                     FROM cards WHERE nid IN (SELECT nid FROM siblings) GROUP BY nid),
+                 pairs AS
+                    (SELECT later.nid AS nid, later.due - earlier.due AS gap,
+                            later.ivl AS ivl, note_sizes.cards_per_note AS cards_per_note
+                     FROM siblings AS earlier
+                     JOIN siblings AS later ON later.nid = earlier.nid
+                          AND (later.due > earlier.due
+                               OR (later.due = earlier.due AND later.id > earlier.id))
+                     JOIN note_sizes ON note_sizes.nid = earlier.nid)
+            SELECT min(gap, {MAX_GAP}), count(),
+                   (SELECT count(DISTINCT pairs.nid) FROM pairs
+                    JOIN minimum_gaps USING (cards_per_note)
+                    WHERE pairs.ivl BETWEEN minimum_gaps.low AND minimum_gaps.high
+                      AND pairs.gap < minimum_gaps.minimum_gap)
+            FROM pairs
+            GROUP BY 1
+        """,
+        deck_id,
+        deck_id,
+    )
+
+    gap_counts = [0] * len(GAP_BUCKETS)
+    notes_too_close = 0
+
+    for gap, count, notes_too_close in rows:
+        for index, (low, high, _label) in enumerate(GAP_BUCKETS):
+            if low <= gap <= high:
+                gap_counts[index] += count
+
+    return Collisions(gap_counts, notes_too_close)
+
+
+########################################################################################
+
+
+# Deck id to curve and collisions
+cache: "dict[int, tuple[DelayCurve, Collisions]]" = {}
+
+
+def get_collisions(deck_id: int, curve: DelayCurve) -> Collisions:
+    cached = cache.get(deck_id)
+
+    if cached is not None and cached[0] == curve:
+        return cached[1]
+
+    collisions = query_collisions(deck_id, curve)
+    cache[deck_id] = curve, collisions
+    return collisions
+
+
+def clear_collisions_cache():
+    cache.clear()
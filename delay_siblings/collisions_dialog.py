@@ -0,0 +1,61 @@
+import aqt
+from aqt.qt import (
+    QDialog,
+    QVBoxLayout,
+    QDialogButtonBox,
+    QTableWidget,
+    QTableWidgetItem,
+    QAbstractItemView,
+    QLabel,
+    qconnect,
+)
+
+from .collisions import GAP_BUCKETS, get_collisions
+
+
+COLUMNS = ["Deck", *(label for _low, _high, label in GAP_BUCKETS), "Notes too close"]
+
+
+# noinspection PyAttributeOutsideInit
+class CollisionsDialog(QDialog):
+    def __init__(self, deck_ids, get_delay_curve):
+        super().__init__(aqt.mw)  # noqa
+        aqt.mw.garbage_collect_on_dialog_finish(self)
+        self.setWindowTitle("Delay siblings: sibling collisions")
+        self.resize(800, 300)
+        self.create_interface()
+        self.fill_table(deck_ids, get_delay_curve)
+
+    def create_interface(self):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(12, 12, 12, 12)
+        layout.setSpacing(12)
+
+        label = QLabel(
+            "Number of pairs of review siblings, by how many days apart they are due, "
+            "in each deck with sibling delaying enabled. Notes too close are notes "
+            "with a sibling that would be delayed if the other sibling was reviewed.",
+            self,
+        )
+        label.setWordWrap(True)
+        layout.addWidget(label)  # noqa
+
+        self.table = QTableWidget(0, len(COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.table)  # noqa
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close, self)
+        qconnect(button_box.rejected, self.reject)
+        layout.addWidget(button_box)  # noqa
+
+    def fill_table(self, deck_ids, get_delay_curve):
+        self.table.setRowCount(len(deck_ids))
+
+        for row_index, deck_id in enumerate(deck_ids):
+            collisions = get_collisions(int(deck_id), get_delay_curve(int(deck_id)))
+            values = [aqt.mw.col.decks.name(int(deck_id)),
+                      *(str(count) for count in collisions.gap_counts),
+                      str(collisions.notes_too_close)]
+            for column_index, value in enumerate(values):
+                self.table.setItem(row_index, column_index, QTableWidgetItem(value))
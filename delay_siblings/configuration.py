@@ -1,23 +1,34 @@
+import hashlib
+import json
 import traceback
 import jsonschema
 
+from contextlib import suppress
 from typing import Sequence
 
 from aqt import mw
+from aqt.qt import QTimer, qconnect
 from aqt.utils import showWarning
 
-from .tools import get_current_deck_id
+from .delaying import DelayCurve, DEFAULT_DELAY_CURVE
+from .tools import get_current_deck_id, get_user_files_path
 
 
 ENABLED_FOR_DECKS = "enabled_for_decks"
 QUIET = "quiet"
 DELAY_AFTER_SYNC = "delay_after_sync"
+DELAY_CURVES = "delay_curves"
+IDLE_SWEEP = "idle_sweep"
+DELAY_AT_END_OF_SESSION = "delay_at_end_of_session"
+RELATED_NOTES_FIELD = "related_notes_field"
 VERSION = "version"
 
 DELAY_WITHOUT_ASKING = "delay_without_asking"
 ASK_EVERY_TIME = "ask_every_time"
 DO_NOT_DELAY = "do_not_delay"
 
+SAVE_DELAY_MILLISECONDS = 1000
+
 
 tag = mw.addonManager.addonFromModule(__name__)
 
@@ -41,14 +52,39 @@ def run_on_configuration_change(function):
 ########################################################################################
 
 
+# Writing config rewrites meta.json of the add-on, so the setters don't save right away.
+# Instead, the writes are coalesced into a single one that happens either
+# after a short quiet period, or when profile closes.
+# Loading the config discards any pending write, as the loaded config wins.
 # noinspection PyAttributeOutsideInit
 class Config:
-    def load(self):
+    def __init__(self):
+        self.save_timer = QTimer(mw)
+        self.save_timer.setSingleShot(True)
+        qconnect(self.save_timer.timeout, self.save_now)
+
+    # Returns whether the data changed
+    def load(self) -> bool:
+        self.save_timer.stop()
+        old_data = getattr(self, "data", None)
         self.data = migrate_data_restoring_default_config_on_error(load_config())
+        self.deck_id_to_delay_curve = {
+            int(deck_id): DelayCurve(**parameters)
+            for deck_id, parameters in self.data[DELAY_CURVES].items()
+        }
+        return self.data != old_data
 
     def save(self):
+        self.save_timer.start(SAVE_DELAY_MILLISECONDS)
+
+    def save_now(self):
+        self.save_timer.stop()
         save_config(self.data)
 
+    def save_now_if_pending(self):
+        if self.save_timer.isActive():
+            self.save_now()
+
     @property
     def enabled_for_deck_ids(self) -> Sequence[str]:
         return [deck_id for deck_id, enabled in self.data[ENABLED_FOR_DECKS].items() if enabled is True]
@@ -80,6 +116,77 @@ class Config:
         self.data[DELAY_AFTER_SYNC] = value
         self.save()
 
+    @property
+    def delay_at_end_of_session(self):
+        return self.data[DELAY_AT_END_OF_SESSION]
+
+    @delay_at_end_of_session.setter
+    def delay_at_end_of_session(self, value):
+        self.data[DELAY_AT_END_OF_SESSION] = value
+        self.save()
+
+    # Empty if related notes are not treated as siblings, see `related_notes.py`
+    @property
+    def related_notes_field(self) -> str:
+        return self.data[RELATED_NOTES_FIELD]
+
+    @property
+    def idle_sweep(self):
+        return self.data[IDLE_SWEEP]["enabled"]
+
+    @idle_sweep.setter
+    def idle_sweep(self, value):
+        self.data[IDLE_SWEEP]["enabled"] = value
+        self.save()
+
+    @property
+    def idle_sweep_milliseconds_per_tick(self) -> int:
+        return self.data[IDLE_SWEEP]["milliseconds_per_tick"]
+
+    # Curves are per home deck of a card, and are only configurable via the config editor
+    def get_delay_curve(self, deck_id: int) -> DelayCurve:
+        return self.deck_id_to_delay_curve.get(deck_id, DEFAULT_DELAY_CURVE)
+
+
+########################################################################################
+
+
+# Validating is by far the slowest part of loading the config,
+# and the config rarely changes between loads. So we remember the fingerprint
+# of the last data that passed validation, and only validate when it differs.
+# The schema is part of the fingerprint, so that add-on updates trigger validation.
+# The fingerprint is stored on disk, so that it is not lost between launches.
+CONFIG_FINGERPRINT_FILENAME = "validated_config_fingerprint.txt"
+
+validated_config_fingerprint = None
+
+def get_config_fingerprint(data) -> str:
+    text = json.dumps([data, mw.addonManager._addon_schema(tag)], sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+def load_validated_config_fingerprint():
+    try:
+        with open(get_user_files_path(CONFIG_FINGERPRINT_FILENAME)) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+def save_validated_config_fingerprint(fingerprint):
+    with suppress(OSError):
+        with open(get_user_files_path(CONFIG_FINGERPRINT_FILENAME), "w") as file:
+            file.write(fingerprint)
+
+def validate_config_unless_already_validated(data):
+    global validated_config_fingerprint
+    if validated_config_fingerprint is None:
+        validated_config_fingerprint = load_validated_config_fingerprint()
+
+    fingerprint = get_config_fingerprint(data)
+    if fingerprint != validated_config_fingerprint:
+        validate_config(data)
+        validated_config_fingerprint = fingerprint
+        save_validated_config_fingerprint(fingerprint)
+
 
 ########################################################################################
 
@@ -105,7 +212,43 @@ def migrate(data):
             DELAY_AFTER_SYNC: ASK_EVERY_TIME
         }
 
-    validate_config(data)
+    if data["version"] == 1:
+        print(":: delay siblings: migrating config from version 1")
+
+        data = {
+            **data,
+            VERSION: 2,
+            DELAY_CURVES: {},
+        }
+
+    if data["version"] == 2:
+        print(":: delay siblings: migrating config from version 2")
+
+        data = {
+            **data,
+            VERSION: 3,
+            IDLE_SWEEP: {"enabled": False, "milliseconds_per_tick": 50},
+        }
+
+    if data["version"] == 3:
+        print(":: delay siblings: migrating config from version 3")
+
+        data = {
+            **data,
+            VERSION: 4,
+            DELAY_AT_END_OF_SESSION: False,
+        }
+
+    if data["version"] == 4:
+        print(":: delay siblings: migrating config from version 4")
+
+        data = {
+            **data,
+            VERSION: 5,
+            RELATED_NOTES_FIELD: "",
+        }
+
+    validate_config_unless_already_validated(data)
 
     return data
 
@@ -1,15 +1,29 @@
 import aqt
-from aqt.qt import QDialog, QVBoxLayout, QDialogButtonBox, QListWidget, QLabel, qconnect
+from aqt.qt import (
+    QDialog,
+    QVBoxLayout,
+    QDialogButtonBox,
+    QListView,
+    QLabel,
+    QAbstractListModel,
+    QModelIndex,
+    QFileDialog,
+    Qt,
+    qconnect,
+)
+from aqt.utils import tooltip
 
-from .tools import html_to_text_line
+from .delaying import Delay
+from .export import export_delays, get_format_from_path
+from .tools import get_question_text_line
 
 
-def get_delayed_message(delay):
-    question = html_to_text_line(delay.sibling.question())
+def get_delayed_message(delay: Delay):
+    question = get_question_text_line(delay.card_id, delay.note_id)
     if len(question) > 30:
         question = question[:30] + "…"
     today = aqt.mw.col.sched.today
-    interval = delay.sibling.ivl
+    interval = delay.interval
     old_relative_due = delay.old_absolute_due - today
     new_relative_due = delay.new_absolute_due - today
 
@@ -17,38 +31,58 @@ def get_delayed_message(delay):
            f"due: {old_relative_due} → {new_relative_due} days after today)"
 
 
+# There can be thousands of delays, and getting the question of a card is not cheap,
+# so the messages are only made for the rows that the list actually shows
+class DelayListModel(QAbstractListModel):
+    def __init__(self, delays: "list[Delay]", parent):
+        super().__init__(parent)
+        self.delays = delays
+
+    def rowCount(self, parent=QModelIndex()):  # noqa
+        return 0 if parent.isValid() else len(self.delays)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role == Qt.ItemDataRole.DisplayRole:
+            return get_delayed_message(self.delays[index.row()])
+        return None
+
+
 # noinspection PyAttributeOutsideInit
 class DelayAfterSyncDialog(QDialog):
-    def __init__(self, delays, on_accepted):
+    def __init__(self, delays, on_accepted,
+                 message="After sync, I found some siblings that should have been delayed. "
+                         "Delay now?"):
         super().__init__(aqt.mw)  # noqa
         aqt.mw.garbage_collect_on_dialog_finish(self)
         self.setWindowTitle("Delay siblings")
         self.resize(500, 300)
-        self.create_interface()
+        self.create_interface(message)
 
         self.delays = delays
         self.on_accepted = on_accepted
 
-        self.list.addItems(get_delayed_message(delay) for delay in delays)
+        self.list.setModel(DelayListModel(delays, self))
 
-    def create_interface(self):
+    def create_interface(self, message):
         layout = QVBoxLayout(self)
         layout.setContentsMargins(12, 12, 12, 12)
         layout.setSpacing(12)
 
-        label = QLabel("After sync, I found some siblings that "
-                       "should have been delayed. Delay now?")
+        label = QLabel(message)
         layout.addWidget(label)  # noqa
 
-        self.list = QListWidget(self)
+        self.list = QListView(self)
+        self.list.setUniformItemSizes(True)
         qconnect(self.list.doubleClicked, self.list_item_double_clicked)
         layout.addWidget(self.list)  # noqa
 
         button_box = QDialogButtonBox(self)
         delay_button = button_box.addButton("Delay", QDialogButtonBox.ButtonRole.AcceptRole)
         cancel_button = button_box.addButton("Cancel", QDialogButtonBox.ButtonRole.RejectRole)
+        export_button = button_box.addButton("Export…", QDialogButtonBox.ButtonRole.ActionRole)
         qconnect(delay_button.clicked, self.accept)
         qconnect(cancel_button.clicked, self.reject)
+        qconnect(export_button.clicked, self.export)
         layout.addWidget(button_box)  # noqa
 
     # Open browser and show all cards for the selected note,
@@ -61,10 +95,21 @@ class DelayAfterSyncDialog(QDialog):
     # Let's just hope they won't do any of such nonsense, handling it would be hard.
     def list_item_double_clicked(self):
         index = self.list.selectedIndexes()[0].row()
-        sibling = self.delays[index].sibling
+        delay = self.delays[index]
         browser = aqt.dialogs.open("Browser", aqt.mw)
-        browser.search_for(f"cid:{sibling.id}")
-        browser.search_for(f"nid:{sibling.nid}")
+        browser.search_for(f"cid:{delay.card_id}")
+        browser.search_for(f"nid:{delay.note_id}")
+
+    def export(self):
+        path, _filter = QFileDialog.getSaveFileName(
+            self, "Export delays", "delays.csv", "CSV (*.csv);;JSON Lines (*.jsonl)"
+        )
+
+        if path:
+            with open(path, "w", newline="", encoding="utf-8") as file:
+                export_delays(self.delays, file, get_format_from_path(path),
+                              today=aqt.mw.col.sched.today, get_deck_name=aqt.mw.col.decks.name)
+            tooltip(f"Exported {len(self.delays)} delays", parent=self)
 
     def accept(self):
         super().accept()
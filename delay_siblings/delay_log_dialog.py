@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+import aqt
+from aqt.qt import (
+    QDialog,
+    QVBoxLayout,
+    QHBoxLayout,
+    QDialogButtonBox,
+    QTableWidget,
+    QTableWidgetItem,
+    QAbstractItemView,
+    QLineEdit,
+    QPushButton,
+    qconnect,
+)
+
+from .audit_log import delay_log, PAGE_SIZE
+from .tools import get_collection_genesis_datetime
+
+
+COLUMNS = ["Time", "Source", "Card", "Note", "Due before", "Due after"]
+
+
+# noinspection PyAttributeOutsideInit
+class DelayLogDialog(QDialog):
+    def __init__(self):
+        super().__init__(aqt.mw)  # noqa
+        aqt.mw.garbage_collect_on_dialog_finish(self)
+        self.setWindowTitle("Delay siblings: delay log")
+        self.resize(700, 500)
+        self.create_interface()
+
+        self.genesis = get_collection_genesis_datetime()
+        self.page_first_ids = []  # for each of the newer pages, the id it starts before
+        self.rows = []
+        self.show_page(before_id=None)
+
+    def create_interface(self):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(12, 12, 12, 12)
+        layout.setSpacing(12)
+
+        self.card_id_edit = QLineEdit(self)
+        self.card_id_edit.setPlaceholderText("Card id (leave empty to show all cards)")
+        qconnect(self.card_id_edit.returnPressed, self.card_id_changed)
+        layout.addWidget(self.card_id_edit)  # noqa
+
+        self.table = QTableWidget(0, len(COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        qconnect(self.table.doubleClicked, self.row_double_clicked)
+        layout.addWidget(self.table)  # noqa
+
+        buttons = QHBoxLayout()
+        self.newer_button = QPushButton("< Newer", self)
+        self.older_button = QPushButton("Older >", self)
+        qconnect(self.newer_button.clicked, self.show_newer_page)
+        qconnect(self.older_button.clicked, self.show_older_page)
+        buttons.addWidget(self.newer_button)  # noqa
+        buttons.addWidget(self.older_button)  # noqa
+        buttons.addStretch()
+        layout.addLayout(buttons)  # noqa
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close, self)
+        qconnect(button_box.rejected, self.reject)
+        layout.addWidget(button_box)  # noqa
+
+    def get_card_id(self):
+        text = self.card_id_edit.text().strip()
+        return int(text) if text.isdigit() else None
+
+    def anki_day_to_string(self, anki_day: int) -> str:
+        return (self.genesis + timedelta(days=anki_day)).strftime("%Y-%m-%d")
+
+    # The pages are found by the id of the last row of the previous page,
+    # so showing any page is fast no matter how large the log is
+    def show_page(self, before_id):
+        self.rows = delay_log.get_page(before_id=before_id, card_id=self.get_card_id())
+        self.table.setRowCount(len(self.rows))
+
+        for row_index, (_id, time, card_id, note_id, old_due, new_due, source) \
+                in enumerate(self.rows):
+            values = [
+                datetime.fromtimestamp(time / 1000).strftime("%Y-%m-%d %H:%M"),
+                source,
+                str(card_id),
+                str(note_id),
+                self.anki_day_to_string(old_due),
+                self.anki_day_to_string(new_due),
+            ]
+            for column_index, value in enumerate(values):
+                self.table.setItem(row_index, column_index, QTableWidgetItem(value))
+
+        self.newer_button.setEnabled(bool(self.page_first_ids))
+        self.older_button.setEnabled(len(self.rows) == PAGE_SIZE)
+
+    def card_id_changed(self):
+        self.page_first_ids = []
+        self.show_page(before_id=None)
+
+    def show_older_page(self):
+        if self.rows:
+            self.page_first_ids.append(self.rows[0][0] + 1)
+            self.show_page(before_id=self.rows[-1][0])
+
+    def show_newer_page(self):
+        if self.page_first_ids:
+            self.show_page(before_id=self.page_first_ids.pop())
+
+    # See `DelayAfterSyncDialog.list_item_double_clicked`
+    def row_double_clicked(self):
+        row = self.rows[self.table.selectedIndexes()[0].row()]
+        card_id, note_id = row[2], row[3]
+        browser = aqt.dialogs.open("Browser", aqt.mw)
+        browser.search_for(f"cid:{card_id}")
+        browser.search_for(f"nid:{note_id}")
@@ -0,0 +1,168 @@
+# The rule by which siblings are delayed. This module doesn't touch the collection,
+# and works with compact rows of card data rather than with cards.
+
+from array import array
+from dataclasses import dataclass
+from typing import Callable, Optional, Sequence
+
+from anki.consts import QUEUE_TYPE_SUSPENDED, CARD_TYPE_REV as CARD_TYPE_REVIEWING
+
+
+# card id, type, queue, interval, due, original due, original deck id, deck id
+SiblingRow = "tuple[int, int, int, int, int, int, int, int]"
+
+# card id, old absolute due, new absolute due
+DelayRow = "tuple[int, int, int]"
+
+# The columns of the cards table that make up a `SiblingRow`
+SIBLING_ROW_COLUMNS = "id, type, queue, ivl, due, odue, odid, did"
+
+
+# A delay that is about to be applied, or was applied, to a sibling.
+# After sync, there can be thousands of these, kept for as long as the dialog is open,
+# so these only hold the few numbers we need, rather than the cards.
+@dataclass
+class Delay:
+    __slots__ = ("card_id", "note_id", "interval", "home_deck_id", "in_filtered_deck",
+                 "old_absolute_due", "new_absolute_due")
+    card_id: int
+    note_id: int
+    interval: int
+    home_deck_id: int
+    in_filtered_deck: bool
+    old_absolute_due: int
+    new_absolute_due: int
+
+
+# The delay curve can be configured for each deck, see `config.md`.
+# With the default parameters, the ranges are as follows.
+#
+# Interval → ranges for 2; 3 cards per note:
+#    0 →    0-0;   0-0
+#    1 →    0-0;   0-0
+#    2 →    1-1;   0-0
+#    3 →    1-1;   1-1
+#    4 →    1-1;   1-1
+#    5 →    1-2;   1-1
+#    6 →    2-2;   1-1
+#    7 →    2-2;   1-2
+#    8 →    2-3;   1-2
+#    9 →    2-3;   2-2
+#   10 →    2-3;   2-2
+#   12 →    3-4;   2-3
+#   14 →    3-4;   2-3
+#   16 →    4-5;   2-3
+#   18 →    4-5;   3-4
+#   20 →    4-6;   3-4
+#   30 →    6-8;   4-5
+#   60 →  10-13;   7-9
+#   90 →  13-17;  9-11
+#  180 →  19-25; 13-17
+#  360 →  28-37; 19-24
+#  720 →  40-52; 27-35
+# 1500 →  57-74; 38-49
+# 3000 → 78-101; 52-67
+# https://www.desmos.com/calculator/fnh882qnd1
+@dataclass(frozen=True)
+class DelayCurve:
+    interval_factor: float = 24.0
+    interval_offset: float = 310
+    exponent: float = 0.4
+    subtrahend: float = 10
+    siblings_factor: float = 2
+    max_multiplier: float = 1.3
+
+    def calculate_range(self, interval: int, cards_per_note: int) -> (int, int):
+        f = (self.interval_factor * interval + self.interval_offset) ** self.exponent \
+            - self.subtrahend
+        f = f * self.siblings_factor / cards_per_note
+        return int(round(f)), int(round(f * self.max_multiplier))
+
+
+DEFAULT_DELAY_CURVE = DelayCurve()
+
+
+# Computing the range involves a power, so for every curve and number of cards per note
+# the ranges for all but very long intervals are computed once and put in a table.
+# This way the cost of looking up a range doesn't depend on how many curves there are.
+# The tables are kept until config changes, see `clear_range_tables`.
+MAX_TABULATED_INTERVAL = 3650
+
+curve_and_cards_per_note_to_range_table: "dict[tuple[DelayCurve, int], tuple]" = {}
+
+def get_range_table(curve: DelayCurve, cards_per_note: int) -> ("array[int]", "array[int]"):
+    table = curve_and_cards_per_note_to_range_table.get((curve, cards_per_note))
+
+    if table is None:
+        minimums, maximums = array("i"), array("i")
+        for interval in range(MAX_TABULATED_INTERVAL + 1):
+            minimum, maximum = curve.calculate_range(interval, cards_per_note)
+            minimums.append(minimum)
+            maximums.append(maximum)
+        table = curve_and_cards_per_note_to_range_table[curve, cards_per_note] = \
+            minimums, maximums
+
+    return table
+
+
+def clear_range_tables():
+    curve_and_cards_per_note_to_range_table.clear()
+
+
+def calculate_new_relative_due_range(interval: int, cards_per_note: int,
+                                     curve: DelayCurve = DEFAULT_DELAY_CURVE) -> (int, int):
+    if 0 <= interval <= MAX_TABULATED_INTERVAL:
+        minimums, maximums = get_range_table(curve, cards_per_note)
+        return minimums[interval], maximums[interval]
+    return curve.calculate_range(interval, cards_per_note)
+
+
+# Returns the new absolute due of a sibling that is due too close
+# to the day the card was reviewed, or None if the sibling is fine as it is.
+# Takes `randint`, so that the callers can use their own random generator.
+def calculate_new_absolute_due(
+    interval: int,
+    cards_per_note: int,
+    old_absolute_due: int,
+    rescheduling_day: int,
+    randint: Callable[[int, int], int],
+    curve: DelayCurve = DEFAULT_DELAY_CURVE,
+) -> Optional[int]:
+    old_relative_due = old_absolute_due - rescheduling_day
+    new_relative_due_min, new_relative_due_max = \
+        calculate_new_relative_due_range(interval, cards_per_note, curve)
+
+    if new_relative_due_min > 0 and new_relative_due_min > old_relative_due:
+        return rescheduling_day + randint(new_relative_due_min, new_relative_due_max)
+
+    return None
+
+
+# Receives all cards of a note except the one that was reviewed
+def calculate_delay_rows(
+    sibling_rows: Sequence[SiblingRow],
+    rescheduling_day: int,
+    randint: Callable[[int, int], int],
+    deck_id_to_curve: "dict[int, DelayCurve]",
+) -> "list[DelayRow]":
+    cards_per_note = len(sibling_rows) + 1
+    result = []
+
+    for card_id, card_type, queue, interval, due, odue, odid, did in sibling_rows:
+        if card_type != CARD_TYPE_REVIEWING or queue == QUEUE_TYPE_SUSPENDED:
+            continue
+
+        old_absolute_due = odue if odue != 0 and odid != 0 else due
+        new_absolute_due = calculate_new_absolute_due(
+            interval=interval,
+            cards_per_note=cards_per_note,
+            old_absolute_due=old_absolute_due,
+            rescheduling_day=rescheduling_day,
+            randint=randint,
+            curve=deck_id_to_curve.get(odid or did, DEFAULT_DELAY_CURVE),
+        )
+
+        if new_absolute_due is not None:
+            result.append((card_id, old_absolute_due, new_absolute_due))
+
+    return result
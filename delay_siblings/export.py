@@ -0,0 +1,170 @@
+# Exporting planned delays as CSV or JSON Lines, to look at them outside of Anki.
+# The rows are produced by generators and written one by one,
+# so that exporting hundreds of thousands of delays doesn't take much memory.
+#
+# This module doesn't need Anki's GUI, and can also be run as a script
+# to see what delays the add-on would make in a collection, for instance:
+#
+#   python delay_siblings/export.py collection.anki2 1234567890123 --format csv > plan.csv
+#
+# This treats the latest review of each note in given decks as if it was just synced,
+# same as the idle sweep does. The default delay curve is used.
+# Close Anki before running this, as it needs to open the collection.
+
+import argparse
+import csv
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, Sequence, TextIO
+
+from anki.consts import REVLOG_RESCHED
+
+try:
+    from .delaying import Delay, SIBLING_ROW_COLUMNS, calculate_delay_rows
+except ImportError:  # running as a script
+    from delaying import Delay, SIBLING_ROW_COLUMNS, calculate_delay_rows  # noqa
+
+
+CSV = "csv"
+JSONL = "jsonl"
+
+EXPORT_COLUMNS = ["deck", "note", "card", "interval", "old_relative_due", "new_relative_due"]
+
+
+def get_export_rows(delays: Iterable[Delay], today: int,
+                    get_deck_name: Callable[[int], str]) -> Iterator[tuple]:
+    get_deck_name = lru_cache(maxsize=None)(get_deck_name)
+
+    for delay in delays:
+        yield (
+            get_deck_name(delay.home_deck_id),
+            delay.note_id,
+            delay.card_id,
+            delay.interval,
+            delay.old_absolute_due - today,
+            delay.new_absolute_due - today,
+        )
+
+
+def write_csv(rows: Iterable[tuple], file: TextIO):
+    writer = csv.writer(file)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_jsonl(rows: Iterable[tuple], file: TextIO):
+    for row in rows:
+        file.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+
+
+def get_format_from_path(path: str) -> str:
+    return JSONL if path.lower().endswith((".jsonl", ".json")) else CSV
+
+
+def export_delays(delays: Iterable[Delay], file: TextIO, export_format: str, today: int,
+                  get_deck_name: Callable[[int], str]):
+    rows = get_export_rows(delays, today, get_deck_name)
+    (write_jsonl if export_format == JSONL else write_csv)(rows, file)
+
+
+########################################################################################
+##################################################################### command line tool
+########################################################################################
+
+
+NOTES_PER_CHUNK = 1000
+
+
+# See `get_collection_genesis_datetime` in `tools.py`
+def get_genesis(col) -> datetime:
+    timing = col.sched._timing_today()  # noqa
+    today_started_at = datetime.fromtimestamp(timing.next_day_at) - timedelta(days=1)
+    return today_started_at - timedelta(days=timing.days_elapsed)
+
+
+# Goes through the notes in chunks, so that only a chunk of cards is in memory at a time
+def plan_delays(col, deck_ids: Sequence[int]) -> Iterator[Delay]:
+    wanted_deck_ids = "(" + ",".join(str(deck_id) for deck_id in deck_ids) + ")"
+    today = col.sched.today
+    genesis = get_genesis(col)
+    last_note_id = 0
+
+    while True:
+        note_ids = col.db.list(
+            f"""
+                SELECT DISTINCT nid FROM cards
+                WHERE (did IN {wanted_deck_ids} OR odid IN {wanted_deck_ids}) AND nid > ?
+                ORDER BY nid LIMIT ?
+            """,
+            last_note_id,
+            NOTES_PER_CHUNK,
+        )
+
+        if not note_ids:
+            return
+
+        last_note_id = note_ids[-1]
+        wanted_note_ids = "(" + ",".join(str(note_id) for note_id in note_ids) + ")"
+        note_id_to_rows = {}
+
+        for note_id, *row in col.db.all(
+            f"SELECT nid, {SIBLING_ROW_COLUMNS} FROM cards WHERE nid IN {wanted_note_ids}"
+        ):
+            note_id_to_rows.setdefault(note_id, []).append(row)
+
+        # SQLite takes the other columns from the row that has the max id.
+        # Manual reschedules, the add-on's own delays included, are not reviews
+        for note_id, reviewed_card_id, review_id in col.db.all(
+            f"""
+                SELECT cards.nid, revlog.cid, max(revlog.id)
+                FROM revlog JOIN cards ON cards.id = revlog.cid
+                WHERE cards.nid IN {wanted_note_ids} AND revlog.type != {REVLOG_RESCHED}
+                GROUP BY cards.nid
+            """
+        ):
+            rows = note_id_to_rows[note_id]
+            sibling_rows = [row for row in rows if row[0] != reviewed_card_id]
+            card_id_to_row = {row[0]: row for row in sibling_rows}
+            rescheduling_day = (datetime.fromtimestamp(review_id / 1000) - genesis).days
+
+            for card_id, old_absolute_due, new_absolute_due in calculate_delay_rows(
+                sibling_rows, rescheduling_day, random.randint, deck_id_to_curve={}
+            ):
+                if new_absolute_due > today:
+                    _, _, _, interval, _, odue, odid, did = card_id_to_row[card_id]
+                    yield Delay(card_id, note_id, interval, odid or did, odue != 0 and odid != 0,
+                                old_absolute_due, new_absolute_due)
+
+
+def main(arguments: Sequence[str] = None):
+    parser = argparse.ArgumentParser(
+        description="Export the delays that Delay siblings would make in a collection."
+    )
+    parser.add_argument("collection", help="path to collection.anki2")
+    parser.add_argument("deck_ids", type=int, nargs="+", help="ids of the decks to look at")
+    parser.add_argument("--format", choices=[CSV, JSONL], default=CSV)
+    parser.add_argument("--output", help="file to write to; standard output by default")
+    arguments = parser.parse_args(arguments)
+
+    from anki.collection import Collection
+    col = Collection(arguments.collection)
+
+    try:
+        file = open(arguments.output, "w", newline="", encoding="utf-8") \
+            if arguments.output else sys.stdout
+        try:
+            export_delays(plan_delays(col, arguments.deck_ids), file, arguments.format,
+                          today=col.sched.today, get_deck_name=col.decks.name)
+        finally:
+            if file is not sys.stdout:
+                file.close()
+    finally:
+        col.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Notes whose siblings were already looked at today by the reviewer.
+# When a card is shown several times a day, e.g. while it's in learning,
+# or when its siblings are answered one after another, there's nothing new to delay,
+# so the reviewer skips these notes without touching the collection.
+#
+# The set is reset when a new Anki day starts. It is kept in user_files,
+# separately for each profile, and is written when leaving the reviewer
+# and when the profile closes.
+
+import json
+import os
+from typing import Optional
+
+from aqt import mw
+
+from .tools import get_user_files_path, get_anki_today
+
+
+HANDLED_NOTES_FILENAME = "handled_notes.json"
+
+
+class HandledNotes:
+    def __init__(self):
+        self.day: Optional[int] = None
+        self.note_ids: "Optional[set[int]]" = None  # not loaded yet if None
+        self.dirty = False
+
+    def load_profile_to_state(self) -> dict:
+        try:
+            with open(get_user_files_path(HANDLED_NOTES_FILENAME)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def get_note_ids(self) -> "set[int]":
+        if self.note_ids is None:
+            state = self.load_profile_to_state().get(mw.pm.name, {})
+            self.day = state.get("day")
+            self.note_ids = set(state.get("note_ids", []))
+
+        today = get_anki_today()
+        if self.day != today:
+            self.day = today
+            self.note_ids = set()
+            self.dirty = True
+
+        return self.note_ids
+
+    def contains(self, note_id: int) -> bool:
+        return note_id in self.get_note_ids()
+
+    def add(self, note_id: int):
+        self.get_note_ids().add(note_id)
+        self.dirty = True
+
+    def save(self):
+        if self.dirty and self.note_ids is not None:
+            profile_to_state = self.load_profile_to_state()
+            profile_to_state[mw.pm.name] = {"day": self.day, "note_ids": sorted(self.note_ids)}
+
+            path = get_user_files_path(HANDLED_NOTES_FILENAME)
+            with open(path + ".tmp", "w") as file:
+                json.dump(profile_to_state, file)
+            os.replace(path + ".tmp", path)
+            self.dirty = False
+
+    def close(self):
+        self.save()
+        self.day = None
+        self.note_ids = None
+
+
+handled_notes = HandledNotes()
@@ -0,0 +1,103 @@
+# Most of the cost of what the add-on does is in database queries and backend calls,
+# so this counts them, along with the number of rows the queries return.
+#
+# Counting is opt-in. Tests use `counting_collection_access` directly,
+# and if DELAY_SIBLINGS_COUNT_QUERIES environmental variable is set,
+# the counts for each of the operations decorated with `@counted` are printed.
+#
+# This works by temporarily wrapping `DBProxy._query` and `executemany`,
+# which all queries go through, and the methods of cards and collection
+# that talk to the backend. Only the calls made while counting are counted,
+# so it's best to count around the code of the add-on only.
+
+import functools
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator
+
+from anki.cards import Card
+from aqt import mw
+
+
+COUNT_QUERIES = bool(os.environ.get("DELAY_SIBLINGS_COUNT_QUERIES"))
+
+
+@dataclass
+class Counts:
+    queries: int = 0
+    rows: int = 0
+    backend_calls: int = 0
+
+
+active_counts: "list[Counts]" = []
+
+
+def count(queries=0, rows=0, backend_calls=0):
+    for counts in active_counts:
+        counts.queries += queries
+        counts.rows += rows
+        counts.backend_calls += backend_calls
+
+
+def wrapped(function, counting_function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        result = function(*args, **kwargs)
+        counting_function(result)
+        return result
+    return wrapper
+
+
+@contextmanager
+def patched_collection_access():
+    db = mw.col.db
+    original_card_flush, original_card_question = Card.flush, Card.question
+
+    db._query = wrapped(db._query, lambda result: count(queries=1, rows=len(result or ())))
+    db.executemany = wrapped(db.executemany, lambda _: count(queries=1))
+    mw.col.get_card = wrapped(mw.col.get_card, lambda _: count(backend_calls=1))
+    Card.flush = wrapped(Card.flush, lambda _: count(backend_calls=1))
+    Card.question = wrapped(Card.question, lambda _: count(backend_calls=1))
+
+    try:
+        yield
+    finally:
+        del db._query, db.executemany, mw.col.get_card
+        Card.flush, Card.question = original_card_flush, original_card_question
+
+
+# Can be nested, in which case the outer counts include the inner ones
+@contextmanager
+def counting_collection_access() -> Iterator[Counts]:
+    counts = Counts()
+
+    if active_counts:
+        active_counts.append(counts)
+        try:
+            yield counts
+        finally:
+            active_counts.remove(counts)
+    else:
+        with patched_collection_access():
+            active_counts.append(counts)
+            try:
+                yield counts
+            finally:
+                active_counts.remove(counts)
+
+
+def counted(operation: str):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not COUNT_QUERIES or mw.col is None:
+                return function(*args, **kwargs)
+
+            with counting_collection_access() as counts:
+                result = function(*args, **kwargs)
+            print(f":: delay siblings: {operation}: {counts.queries} queries, "
+                  f"{counts.rows} rows, {counts.backend_calls} backend calls")
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,67 @@
+# A journal of the last few batches of applied delays, so that a batch can be reverted.
+# A batch is everything applied at once: the delays made by one answer,
+# by one sync, by one pass of the idle sweep, and so on.
+#
+# For each delayed card, the journal keeps its id, due before and after the delay,
+# and whether it was in a filtered deck, as four ints in an array.
+# The journal is only kept in memory, and is cleared when the profile closes.
+
+import time
+from array import array
+from collections import deque
+from typing import Optional, Sequence
+
+from .delaying import Delay
+
+
+MAX_BATCHES = 10
+
+
+class Batch:
+    __slots__ = ("source", "time", "rows")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.time = time.time()
+        self.rows = array("q")
+
+    def __len__(self):
+        return len(self.rows) // 4
+
+    # Yields card id, due before, due after, whether in a filtered deck
+    def __iter__(self):
+        rows = self.rows
+        for index in range(0, len(rows), 4):
+            yield rows[index], rows[index + 1], rows[index + 2], bool(rows[index + 3])
+
+
+class Journal:
+    def __init__(self):
+        self.batches: "deque[Batch]" = deque(maxlen=MAX_BATCHES)
+
+    # Delays applied in several steps, such as in chunks, are recorded into
+    # the batch that the caller got from `Batch(source)` when it started.
+    # The batch joins the journal with its first delays.
+    def record(self, delays: Sequence[Delay], batch: Batch):
+        if not delays:
+            return
+
+        if batch not in self.batches:
+            self.batches.append(batch)
+
+        rows = batch.rows
+        for delay in delays:
+            rows.extend((delay.card_id, delay.old_absolute_due, delay.new_absolute_due,
+                         delay.in_filtered_deck))
+
+    def get_last_batch(self) -> Optional[Batch]:
+        return self.batches[-1] if self.batches else None
+
+    def pop_last_batch(self) -> Optional[Batch]:
+        return self.batches.pop() if self.batches else None
+
+    def clear(self):
+        self.batches.clear()
+
+
+journal = Journal()
@@ -0,0 +1,98 @@
+# Optionally, notes that have the same value in a chosen field, such as the word
+# in vocabulary decks, are treated as related, and their cards as siblings.
+#
+# This is backed by an inverted index of normalized field value to note ids,
+# for the notes in the decks with sibling delaying enabled.
+# Like the sibling index, it's built with a single query when it's needed,
+# and is thrown away by operations that change notes, except for the edits
+# made in the editor, which update the edited note only.
+#
+# Only the regular, in-memory pass looks at related notes, so when they are enabled,
+# the reviewer, sync, backfill, the idle sweep and manual reschedules all use it,
+# and never the passes that process the whole diff in SQL.
+
+from typing import Optional, Sequence
+
+from aqt import mw
+
+from .tools import html_to_text_line
+
+
+def normalize(value: str) -> str:
+    return html_to_text_line(value).strip().casefold()
+
+
+class RelatedNotes:
+    def __init__(self):
+        self.key: Optional[tuple] = None  # field name and deck ids; not built if None
+        self.value_to_note_ids: "dict[str, set[int]]" = {}
+        self.note_id_to_value: "dict[int, str]" = {}
+        self.note_type_id_to_field_index: "dict[int, Optional[int]]" = {}
+
+    def invalidate(self):
+        self.key = None
+        self.value_to_note_ids = {}
+        self.note_id_to_value = {}
+        self.note_type_id_to_field_index = {}
+
+    def get_field_index(self, note_type_id: int, field_name: str) -> Optional[int]:
+        if note_type_id not in self.note_type_id_to_field_index:
+            field_names = [field["name"] for field in mw.col.models.get(note_type_id)["flds"]]
+            self.note_type_id_to_field_index[note_type_id] = \
+                field_names.index(field_name) if field_name in field_names else None
+        return self.note_type_id_to_field_index[note_type_id]
+
+    def add_note(self, note_id: int, note_type_id: int, fields: str, field_name: str):
+        field_index = self.get_field_index(note_type_id, field_name)
+        if field_index is None:
+            return
+
+        value = normalize(fields.split("\x1f")[field_index])
+        if value:
+            self.value_to_note_ids.setdefault(value, set()).add(note_id)
+            self.note_id_to_value[note_id] = value
+
+    def remove_note(self, note_id: int):
+        value = self.note_id_to_value.pop(note_id, None)
+        if value is not None:
+            note_ids = self.value_to_note_ids[value]
+            note_ids.discard(note_id)
+            if not note_ids:
+                del self.value_to_note_ids[value]
+
+    def build(self, field_name: str, deck_ids: Sequence[str]):
+        self.invalidate()
+        wanted_deck_ids = "(" + ",".join(deck_ids) + ")"
+
+        for note_id, note_type_id, fields in mw.col.db.all(
+            f"""
+                SELECT id, mid, flds FROM notes
+                WHERE id IN (SELECT nid FROM cards
+                             WHERE did IN {wanted_deck_ids} OR odid IN {wanted_deck_ids})
+            """
+        ):
+            self.add_note(note_id, note_type_id, fields, field_name)
+
+        self.key = field_name, tuple(deck_ids)
+
+    def get_related_note_ids(self, note_id: int, field_name: str,
+                             deck_ids: Sequence[str]) -> "set[int]":
+        if self.key != (field_name, tuple(deck_ids)):
+            self.build(field_name, deck_ids)
+
+        value = self.note_id_to_value.get(note_id)
+        if value is None:
+            return set()
+        return self.value_to_note_ids[value] - {note_id}
+
+    def reload_note(self, note_id: int):
+        if self.key is None:
+            return
+
+        self.remove_note(note_id)
+        row = mw.col.db.first("SELECT mid, flds FROM notes WHERE id = ?", note_id)
+        if row is not None:
+            self.add_note(note_id, row[0], row[1], field_name=self.key[0])
+
+
+related_notes = RelatedNotes()
@@ -0,0 +1,66 @@
+# Bulk reschedules, such as “Set due date” and “Forget” in the Browser,
+# never go through the reviewer, and the after-sync pass deliberately skips them.
+# Operations don't tell which cards they changed, but Anki logs these in revlog
+# as manual reschedules, so after each operation that changes cards,
+# the manual reschedules logged since the last look are found by a single query,
+# and the siblings of these cards are delayed in one pass, in SQL.
+#
+# The add-on logs its own delays as manual reschedules as well,
+# so the ids of these entries are remembered until the next look, and are skipped.
+# After sync, which can bring manual reschedules made elsewhere, or replace
+# the whole collection, the look starts over from the last revlog entry.
+
+from typing import Optional, Sequence
+
+from anki.consts import REVLOG_RESCHED
+from aqt import mw
+
+
+class ManualReschedules:
+    def __init__(self):
+        self.last_revlog_id: Optional[int] = None  # not started if None
+        self.own_revlog_id_ranges: "list[tuple[int, int]]" = []  # first and last ids
+
+    def get_last_revlog_id(self) -> int:
+        return mw.col.db.scalar("SELECT coalesce(max(id), 0) FROM revlog")
+
+    def start(self):
+        self.last_revlog_id = self.get_last_revlog_id()
+        self.own_revlog_id_ranges = []
+
+    def stop(self):
+        self.last_revlog_id = None
+        self.own_revlog_id_ranges = []
+
+    # Receives what `log_cards_rescheduled` returns
+    def add_own_revlog_ids(self, id_range: "Optional[tuple[int, int]]"):
+        if self.last_revlog_id is not None and id_range is not None:
+            self.own_revlog_id_ranges.append(id_range)
+
+    # Returns a query that selects the manual reschedules of cards in the given decks
+    # logged since the last call, in the form `calculate_delays_for_diff_query` takes:
+    # review id, note id, card id. Returns None if not started, or if revlog didn't change
+    def take_diff_query(self, deck_ids: Sequence[str]) -> Optional[str]:
+        if self.last_revlog_id is None:
+            return None
+
+        previous_revlog_id, self.last_revlog_id = self.last_revlog_id, self.get_last_revlog_id()
+        if self.last_revlog_id == previous_revlog_id:
+            return None
+
+        not_own = "".join(f"AND revlog.id NOT BETWEEN {first_id} AND {last_id} "
+                          for first_id, last_id in self.own_revlog_id_ranges)
+        wanted_deck_ids = "(" + ",".join(deck_ids) + ")"
+        self.own_revlog_id_ranges = []
+
+        return f"""
+            SELECT revlog.id AS review_id, cards.nid AS nid, cards.id AS cid
+            FROM revlog JOIN cards ON cards.id = revlog.cid
+            WHERE revlog.id > {previous_revlog_id} AND revlog.id <= {self.last_revlog_id}
+              AND revlog.type = {REVLOG_RESCHED}
+              {not_own}
+              AND (cards.did IN {wanted_deck_ids} OR cards.odid IN {wanted_deck_ids})
+        """
+
+
+manual_reschedules = ManualReschedules()
@@ -0,0 +1,128 @@
+# An in-memory index of note id to the compact state of its cards,
+# for all notes that have cards in the decks with sibling delaying enabled.
+# Both the reviewer and the after-sync pass get siblings from here,
+# rather than querying the cards table each time.
+#
+# The index is built with a single query, at profile open or when enabled decks change,
+# and is kept current as follows:
+#   * the add-on updates it itself when it reschedules cards;
+#   * when a card is answered, or when the reviewer does something to a card,
+#     such as burying it, the cards of its note are reloaded;
+#   * any other operation that changes cards or decks, such as adding or deleting
+#     notes, editing them in the browser, or undo, as well as sync, throws the index away,
+#     so that it is rebuilt when it's needed next.
+#
+# Changes that bypass operations, e.g. by other add-ons flushing cards directly,
+# can't be seen; in debug mode, which is on if either ANKIDEV or DELAY_SIBLINGS_DEBUG
+# environmental variable is set, every lookup is checked against the database.
+
+import os
+from typing import Optional, Sequence
+
+from aqt import mw
+
+from .delaying import SiblingRow, SIBLING_ROW_COLUMNS
+from .tools import get_sibling_rows
+
+
+DEBUG = bool(os.environ.get("ANKIDEV") or os.environ.get("DELAY_SIBLINGS_DEBUG"))
+
+
+class SiblingIndex:
+    def __init__(self):
+        self.deck_ids: Optional[Sequence[str]] = None  # the index is not built if None
+        self.note_id_to_rows: "dict[int, list[SiblingRow]]" = {}
+        self.card_id_to_note_id: "dict[int, int]" = {}
+
+    def invalidate(self):
+        self.deck_ids = None
+        self.note_id_to_rows = {}
+        self.card_id_to_note_id = {}
+
+    def build(self, deck_ids: Sequence[str]):
+        self.invalidate()
+        wanted_deck_ids = "(" + ",".join(deck_ids) + ")"
+
+        for note_id, *row in mw.col.db.all(
+            f"""
+                SELECT nid, {SIBLING_ROW_COLUMNS} FROM cards
+                WHERE nid IN (SELECT nid FROM cards
+                              WHERE did IN {wanted_deck_ids} OR odid IN {wanted_deck_ids})
+            """
+        ):
+            self.note_id_to_rows.setdefault(note_id, []).append(tuple(row))
+            self.card_id_to_note_id[row[0]] = note_id
+
+        self.deck_ids = list(deck_ids)
+
+    def ensure_built(self, deck_ids: Sequence[str]):
+        if self.deck_ids != list(deck_ids):
+            self.build(deck_ids)
+
+    # Falls back to the database if the card's note is not covered by the index
+    def get_sibling_rows(self, card_id: int, deck_ids: Sequence[str]) -> "list[SiblingRow]":
+        self.ensure_built(deck_ids)
+        note_id = self.card_id_to_note_id.get(card_id)
+
+        if note_id is None:
+            return get_sibling_rows(card_id)
+
+        sibling_rows = [row for row in self.note_id_to_rows[note_id] if row[0] != card_id]
+
+        if DEBUG:
+            self.check_against_database(card_id, note_id, sibling_rows)
+
+        return sibling_rows
+
+    # Unlike `get_sibling_rows`, this doesn't look at notes not covered by the index
+    def get_note_rows(self, note_id: int) -> "list[SiblingRow]":
+        return self.note_id_to_rows.get(note_id, [])
+
+    def check_against_database(self, card_id: int, note_id: int,
+                               sibling_rows: "list[SiblingRow]"):
+        database_rows = [tuple(row) for row in get_sibling_rows(card_id)]
+
+        if sorted(database_rows) != sorted(sibling_rows):
+            print(f":: delay siblings: sibling index is out of date for note {note_id}:\n"
+                  f":: :: index: {sibling_rows}\n:: :: database: {database_rows}")
+            self.reload_note(note_id)
+
+    def reload_note(self, note_id: int):
+        if self.deck_ids is None or note_id not in self.note_id_to_rows:
+            return
+
+        rows = [tuple(row) for row in mw.col.db.all(
+            f"SELECT {SIBLING_ROW_COLUMNS} FROM cards WHERE nid = ?", note_id
+        )]
+
+        for row in self.note_id_to_rows.pop(note_id):
+            self.card_id_to_note_id.pop(row[0], None)
+
+        if rows:
+            self.note_id_to_rows[note_id] = rows
+            for row in rows:
+                self.card_id_to_note_id[row[0]] = note_id
+
+    def reload_card_note(self, card_id: int):
+        note_id = self.card_id_to_note_id.get(card_id)
+        if note_id is not None:
+            self.reload_note(note_id)
+
+    # Does the same thing to the row as `set_card_absolute_due` does to the card
+    def set_card_absolute_due(self, card_id: int, absolute_due: int):
+        note_id = self.card_id_to_note_id.get(card_id)
+        if note_id is None:
+            return
+
+        rows = self.note_id_to_rows[note_id]
+        for index, (row_card_id, card_type, queue, interval, due, odue, odid, did) \
+                in enumerate(rows):
+            if row_card_id == card_id:
+                if odue != 0 and odid != 0:
+                    odue = absolute_due
+                else:
+                    due = absolute_due
+                rows[index] = (card_id, card_type, queue, interval, due, odue, odid, did)
+
+
+sibling_index = SiblingIndex()
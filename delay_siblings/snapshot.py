@@ -0,0 +1,189 @@
+# The state of the collection before sync is kept on disk rather than in memory:
+#   * it is compact: 16 bytes per card, and it is never loaded into memory as a whole,
+#     but is read via mmap instead;
+#   * it survives crashes: if Anki dies mid-sync, the snapshot is still there
+#     during the next sync, and so the reviews brought by the sync that crashed
+#     are not lost to us.
+#
+# The file consists of a header followed by card id/last review time pairs,
+# both 64-bit integers, sorted by card id. The header says which collection
+# the snapshot was taken of, and when. Snapshots of other collections,
+# e.g. of other profiles, as well as snapshots that are too old, are not used.
+
+import mmap
+import os
+import struct
+import time
+from array import array
+from contextlib import contextmanager, suppress
+from hashlib import sha1
+from typing import Optional, Iterator
+
+from aqt import mw
+
+from .tools import get_user_files_path
+
+
+SNAPSHOT_FILENAME = "pre_sync_snapshot.bin"
+
+MAGIC = b"DSSN"
+FORMAT_VERSION = 1
+
+# magic, format version, collection id, creation time in epoch seconds, number of pairs
+HEADER = struct.Struct("=4sHxxqqq")
+
+# If a snapshot is older than this, the sync it was taken for is long gone,
+# and the collection was likely reviewed locally since then
+MAX_SNAPSHOT_AGE_SECONDS = 24 * 60 * 60
+
+
+def get_snapshot_path() -> str:
+    return get_user_files_path(SNAPSHOT_FILENAME)
+
+
+def get_collection_id() -> int:
+    text = f"{mw.col.path}\n{mw.col.crt}"
+    return int.from_bytes(sha1(text.encode()).digest()[:8], "little", signed=True)
+
+
+########################################################################################
+
+
+class Snapshot:
+    def __init__(self, file, memory_map: mmap.mmap):
+        self.file = file
+        self.memory_map = memory_map
+        self.magic, self.format_version, self.collection_id, self.created_at, self.count = \
+            HEADER.unpack_from(memory_map)
+        self.pairs = memoryview(memory_map)[HEADER.size:].cast("q")
+
+    @property
+    def is_valid(self) -> bool:
+        return (
+            self.magic == MAGIC
+            and self.format_version == FORMAT_VERSION
+            and len(self.pairs) == self.count * 2
+        )
+
+    @property
+    def is_foreign(self) -> bool:
+        return self.collection_id != get_collection_id()
+
+    @property
+    def is_stale(self) -> bool:
+        return time.time() - self.created_at > MAX_SNAPSHOT_AGE_SECONDS
+
+    # Binary search over the card ids, which are every other integer
+    def get(self, card_id: int, default=None):
+        low, high = 0, self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            middle_card_id = self.pairs[middle * 2]
+            if middle_card_id < card_id:
+                low = middle + 1
+            elif middle_card_id > card_id:
+                high = middle
+            else:
+                return self.pairs[middle * 2 + 1]
+
+        return default
+
+    def close(self):
+        self.pairs.release()
+        self.memory_map.close()
+        self.file.close()
+
+
+# Yields None if there's no snapshot, or if it's corrupt or of another collection
+@contextmanager
+def opened_snapshot() -> Iterator[Optional[Snapshot]]:
+    try:
+        file = open(get_snapshot_path(), "rb")
+    except OSError:
+        yield None
+        return
+
+    try:
+        memory_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        memory_map = None
+
+    try:
+        snapshot = Snapshot(file, memory_map)
+    except (TypeError, ValueError, struct.error):
+        if memory_map is not None:
+            memory_map.close()
+        file.close()
+        print(":: delay siblings: pre-sync snapshot is corrupt, ignoring")
+        yield None
+        return
+
+    try:
+        if not snapshot.is_valid:
+            print(":: delay siblings: pre-sync snapshot is corrupt, ignoring")
+            yield None
+        elif snapshot.is_foreign:
+            print(":: delay siblings: pre-sync snapshot is of another collection, ignoring")
+            yield None
+        else:
+            yield snapshot
+    finally:
+        snapshot.close()
+
+
+# For the diff to be found in SQL, the snapshot is put into a temporary table,
+# which only lives as long as the database connection, and is dropped right after use.
+# Yields the name of the table.
+SNAPSHOT_TABLE = "temp.delay_siblings_snapshot"
+TABLE_INSERT_CHUNK_SIZE = 10000
+
+@contextmanager
+def snapshot_table(snapshot: Snapshot) -> Iterator[str]:
+    mw.col.db.execute(f"DROP TABLE IF EXISTS {SNAPSHOT_TABLE}")
+    mw.col.db.execute(f"CREATE TABLE {SNAPSHOT_TABLE} "
+                      f"(cid INTEGER PRIMARY KEY, last_review INTEGER NOT NULL)")
+    try:
+        pairs = snapshot.pairs
+        for start in range(0, snapshot.count, TABLE_INSERT_CHUNK_SIZE):
+            end = min(start + TABLE_INSERT_CHUNK_SIZE, snapshot.count)
+            mw.col.db.executemany(
+                f"INSERT INTO {SNAPSHOT_TABLE} VALUES (?, ?)",
+                [(pairs[index * 2], pairs[index * 2 + 1]) for index in range(start, end)],
+            )
+        yield SNAPSHOT_TABLE
+    finally:
+        mw.col.db.execute(f"DROP TABLE IF EXISTS {SNAPSHOT_TABLE}")
+
+
+# Staleness only matters when deciding whether to keep a snapshot of a sync
+# that didn't finish, as the sync that a snapshot is taken for can take a while
+def recent_snapshot_exists() -> bool:
+    with opened_snapshot() as snapshot:
+        return snapshot is not None and not snapshot.is_stale
+
+
+# The file is written next to the old one and then moved over it,
+# so that a crash while writing can't leave a half-written snapshot
+def write_snapshot(card_id_to_last_review: "dict[int, int]"):
+    pairs = array("q")
+    for card_id in sorted(card_id_to_last_review):
+        pairs.append(card_id)
+        pairs.append(card_id_to_last_review[card_id])
+
+    path = get_snapshot_path()
+    temporary_path = path + ".tmp"
+
+    with open(temporary_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, get_collection_id(),
+                               int(time.time()), len(pairs) // 2))
+        pairs.tofile(file)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temporary_path, path)
+
+
+def delete_snapshot():
+    with suppress(FileNotFoundError):
+        os.remove(get_snapshot_path())
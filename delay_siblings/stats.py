@@ -0,0 +1,122 @@
+# Running counts of delayed siblings, per deck and per month, to see what the add-on does.
+# Every delay means one sibling review that would have come too soon after its sibling.
+# The counts are updated whenever delays are applied, rather than computed from history,
+# and are kept in user_files, separately for each profile. Reverted delays are taken back.
+# Like config, they are saved after a short quiet period, and when profile closes.
+#
+# To estimate the time saved, the counts are multiplied by the average time
+# it takes to review a card in the deck. This is computed by a single aggregate query
+# over revlog, and is cached for the rest of the session.
+
+import json
+import os
+from datetime import datetime
+from typing import Sequence
+
+from anki.consts import REVLOG_REV
+from aqt import mw
+from aqt.qt import QTimer, qconnect
+
+from .delaying import Delay
+from .tools import get_user_files_path
+
+
+STATS_FILENAME = "stats.json"
+SAVE_DELAY_MILLISECONDS = 2000
+
+# Deck id to month, as in "2022-05", to the number of delayed siblings
+DeckIdToMonthToCount = "dict[str, dict[str, int]]"
+
+
+class Stats:
+    def __init__(self):
+        self.profile_to_counts = None
+        self.dirty = False
+        self.deck_id_to_average_review_millis = None
+        self.save_timer = QTimer(mw)
+        self.save_timer.setSingleShot(True)
+        qconnect(self.save_timer.timeout, self.save)
+
+    def get_counts(self) -> DeckIdToMonthToCount:
+        if self.profile_to_counts is None:
+            try:
+                with open(get_user_files_path(STATS_FILENAME)) as file:
+                    self.profile_to_counts = json.load(file)
+            except (OSError, ValueError):
+                self.profile_to_counts = {}
+        return self.profile_to_counts.setdefault(mw.pm.name, {})
+
+    def count_delays(self, delays: Sequence[Delay]):
+        if not delays:
+            return
+
+        counts = self.get_counts()
+        month = datetime.now().strftime("%Y-%m")
+
+        for delay in delays:
+            deck_id = str(delay.home_deck_id)
+            month_to_count = counts.setdefault(deck_id, {})
+            month_to_count[month] = month_to_count.get(month, 0) + 1
+
+        self.dirty = True
+        self.save_timer.start(SAVE_DELAY_MILLISECONDS)
+
+    # Takes back the counts of reverted delays, in the month they were applied
+    def uncount_delays(self, delays: Sequence[Delay], applied_at: float):
+        if not delays:
+            return
+
+        counts = self.get_counts()
+        month = datetime.fromtimestamp(applied_at).strftime("%Y-%m")
+
+        for delay in delays:
+            month_to_count = counts.get(str(delay.home_deck_id), {})
+            count = month_to_count.get(month, 0)
+            if count > 1:
+                month_to_count[month] = count - 1
+            elif count == 1:
+                del month_to_count[month]
+
+        self.dirty = True
+        self.save_timer.start(SAVE_DELAY_MILLISECONDS)
+
+    def save(self):
+        self.save_timer.stop()
+        if self.dirty and self.profile_to_counts is not None:
+            path = get_user_files_path(STATS_FILENAME)
+            with open(path + ".tmp", "w") as file:
+                json.dump(self.profile_to_counts, file)
+            os.replace(path + ".tmp", path)
+            self.dirty = False
+
+    def close(self):
+        self.save()
+        self.deck_id_to_average_review_millis = None
+
+    def get_average_review_millis(self, deck_id: int) -> float:
+        if self.deck_id_to_average_review_millis is None:
+            self.deck_id_to_average_review_millis = dict(mw.col.db.all(
+                f"""
+                    SELECT CASE WHEN cards.odid != 0 THEN cards.odid ELSE cards.did END,
+                           avg(revlog.time)
+                    FROM revlog JOIN cards ON cards.id = revlog.cid
+                    WHERE revlog.type = {REVLOG_REV}
+                    GROUP BY 1
+                """
+            ))
+        return self.deck_id_to_average_review_millis.get(deck_id) or 0
+
+    # Returns deck id, month, number of delayed siblings, estimated milliseconds saved;
+    # newest months first
+    def get_rows(self):
+        rows = []
+
+        for deck_id, month_to_count in self.get_counts().items():
+            average_review_millis = self.get_average_review_millis(int(deck_id))
+            for month, count in month_to_count.items():
+                rows.append((int(deck_id), month, count, count * average_review_millis))
+
+        return sorted(rows, key=lambda row: (row[1], row[0]), reverse=True)
+
+
+stats = Stats()
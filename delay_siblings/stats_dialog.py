@@ -0,0 +1,68 @@
+import aqt
+from aqt.qt import (
+    QDialog,
+    QVBoxLayout,
+    QDialogButtonBox,
+    QTableWidget,
+    QTableWidgetItem,
+    QAbstractItemView,
+    QLabel,
+    qconnect,
+)
+
+from .stats import stats
+
+
+COLUMNS = ["Deck", "Month", "Siblings delayed", "Time saved"]
+
+
+def millis_to_string(millis: float) -> str:
+    minutes = int(millis / 1000 / 60)
+    return f"{minutes // 60} h {minutes % 60} min" if minutes >= 60 else f"{minutes} min"
+
+
+# noinspection PyAttributeOutsideInit
+class StatsDialog(QDialog):
+    def __init__(self):
+        super().__init__(aqt.mw)  # noqa
+        aqt.mw.garbage_collect_on_dialog_finish(self)
+        self.setWindowTitle("Delay siblings: statistics")
+        self.resize(600, 400)
+        self.create_interface()
+        self.fill_table()
+
+    def create_interface(self):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(12, 12, 12, 12)
+        layout.setSpacing(12)
+
+        self.label = QLabel(self)
+        self.label.setWordWrap(True)
+        layout.addWidget(self.label)  # noqa
+
+        self.table = QTableWidget(0, len(COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.table)  # noqa
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close, self)
+        qconnect(button_box.rejected, self.reject)
+        layout.addWidget(button_box)  # noqa
+
+    def fill_table(self):
+        rows = stats.get_rows()
+        self.table.setRowCount(len(rows))
+
+        for row_index, (deck_id, month, count, millis_saved) in enumerate(rows):
+            values = [aqt.mw.col.decks.name(deck_id), month, str(count),
+                      millis_to_string(millis_saved)]
+            for column_index, value in enumerate(values):
+                self.table.setItem(row_index, column_index, QTableWidgetItem(value))
+
+        total_count = sum(row[2] for row in rows)
+        total_millis_saved = sum(row[3] for row in rows)
+        self.label.setText(
+            f"Siblings delayed: <b>{total_count}</b>, "
+            f"estimated time saved: <b>{millis_to_string(total_millis_saved)}</b>. "
+            f"Time saved is estimated using the average review time in each deck."
+        )
@@ -0,0 +1,166 @@
+# A background job that, while Anki is sitting idle on the deck list or deck overview,
+# goes through the notes of the enabled decks and delays siblings
+# that are due too soon after the latest review of their note.
+# This catches reviews done before the deck was enabled, or done elsewhere,
+# so that by the time user reviews the deck, the reviewer has little left to do.
+#
+# The job runs on a timer, and each tick processes small chunks of notes
+# until it runs out of its time budget. The notes are processed in note id order,
+# and the id of the last processed note is remembered in user_files,
+# so that the sweep continues where it left off, even after restart.
+# When it gets to the end, it calls `on_pass_completed`, and waits for the next day
+# to start over.
+# The timer is stopped as soon as review starts, and is started again when it ends.
+#
+# Idle means that no delays are being applied in chunks,
+# that user hasn't touched the mouse or the keyboard for a while,
+# and there are no dialogs open, such as the Browser, the editor,
+# or the dialog that asks whether to apply delays, which were computed from the dues
+# that the sweep could change. The input is watched by an application-wide
+# event filter, which is only installed while the timer is running.
+
+import json
+import os
+import time
+from typing import Callable, Sequence
+
+from aqt import mw
+from aqt.qt import QApplication, QDialog, QEvent, QMainWindow, QObject
+
+from .tools import get_user_files_path, get_anki_today
+
+
+SWEEP_STATE_FILENAME = "idle_sweep.json"
+TICK_INTERVAL_MILLISECONDS = 2000
+NOTES_PER_CHUNK = 20
+IDLE_AFTER_SECONDS = 30
+IDLE_STATES = ("deckBrowser", "overview")
+
+INPUT_EVENT_TYPES = {
+    QEvent.Type.KeyPress,
+    QEvent.Type.MouseButtonPress,
+    QEvent.Type.MouseMove,
+    QEvent.Type.Wheel,
+}
+
+
+class InputWatcher(QObject):
+    def __init__(self):
+        super().__init__()
+        self.last_input_time = time.monotonic()
+
+    def eventFilter(self, _watched, event):  # noqa
+        if event.type() in INPUT_EVENT_TYPES:
+            self.last_input_time = time.monotonic()
+        return False
+
+
+# The Browser is a main window, most of the other windows are dialogs
+def is_any_other_window_open() -> bool:
+    return any(
+        widget is not mw and widget.isVisible() and isinstance(widget, (QDialog, QMainWindow))
+        for widget in QApplication.topLevelWidgets()
+    )
+
+
+class IdleSweep:
+    def __init__(self, get_deck_ids: Callable[[], Sequence[str]],
+                 get_milliseconds_per_tick: Callable[[], int],
+                 process_notes: Callable[[Sequence[int]], None],
+                 on_pass_completed: Callable[[], None],
+                 is_busy: Callable[[], bool]):
+        self.get_deck_ids = get_deck_ids
+        self.is_busy = is_busy
+        self.get_milliseconds_per_tick = get_milliseconds_per_tick
+        self.process_notes = process_notes
+        self.on_pass_completed = on_pass_completed
+        self.timer = None
+        self.input_watcher = None
+        self.profile_to_state = None
+
+    def start(self):
+        if self.timer is None:
+            self.input_watcher = InputWatcher()
+            QApplication.instance().installEventFilter(self.input_watcher)
+            self.timer = mw.progress.timer(TICK_INTERVAL_MILLISECONDS, self.tick,
+                                           True, requiresCollection=True)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.stop()
+            self.timer.deleteLater()
+            self.timer = None
+            QApplication.instance().removeEventFilter(self.input_watcher)
+            self.input_watcher = None
+            self.save_state()
+
+    def is_idle(self) -> bool:
+        if mw.state not in IDLE_STATES or mw.col is None or mw.progress.busy() \
+                or self.is_busy():
+            return False
+        if is_any_other_window_open():
+            return False
+        last_input_time = self.input_watcher.last_input_time if self.input_watcher else 0
+        return time.monotonic() - last_input_time >= IDLE_AFTER_SECONDS
+
+    ####################################################################################
+
+    # Cursor is the id of the last processed note;
+    # completed day is the Anki day on which the last full pass finished
+    def get_state(self) -> dict:
+        if self.profile_to_state is None:
+            try:
+                with open(get_user_files_path(SWEEP_STATE_FILENAME)) as file:
+                    self.profile_to_state = json.load(file)
+            except (OSError, ValueError):
+                self.profile_to_state = {}
+        return self.profile_to_state.setdefault(mw.pm.name, {"cursor": 0, "completed_day": None})
+
+    def save_state(self):
+        if self.profile_to_state is not None:
+            path = get_user_files_path(SWEEP_STATE_FILENAME)
+            with open(path + ".tmp", "w") as file:
+                json.dump(self.profile_to_state, file)
+            os.replace(path + ".tmp", path)
+
+    def get_next_note_ids(self, deck_ids: Sequence[str], cursor: int) -> "list[int]":
+        wanted_deck_ids = "(" + ",".join(deck_ids) + ")"
+        return mw.col.db.list(
+            f"""
+                SELECT DISTINCT nid FROM cards
+                WHERE (did IN {wanted_deck_ids} OR odid IN {wanted_deck_ids}) AND nid > ?
+                ORDER BY nid LIMIT ?
+            """,
+            cursor,
+            NOTES_PER_CHUNK,
+        )
+
+    ####################################################################################
+
+    # Returns whether the pass is completed
+    def tick(self) -> bool:
+        if not self.is_idle():
+            return False
+
+        deck_ids = self.get_deck_ids()
+        state = self.get_state()
+
+        if not deck_ids or state["completed_day"] == get_anki_today():
+            return True
+
+        deadline = time.monotonic() + self.get_milliseconds_per_tick() / 1000
+
+        while time.monotonic() < deadline:
+            note_ids = self.get_next_note_ids(deck_ids, state["cursor"])
+
+            if not note_ids:
+                state["cursor"] = 0
+                state["completed_day"] = get_anki_today()
+                self.save_state()
+                self.on_pass_completed()
+                return True
+
+            self.process_notes(note_ids)
+            state["cursor"] = note_ids[-1]
+
+        return False
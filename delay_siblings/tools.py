@@ -1,12 +1,18 @@
+import os
+import time
 from contextlib import suppress
 from datetime import datetime, timedelta
-from typing import Sequence, Callable
+from functools import lru_cache
+from typing import Callable, Iterable, Optional, Sequence
 
 from anki.cards import Card
-from anki.consts import QUEUE_TYPE_SUSPENDED, CARD_TYPE_REV as CARD_TYPE_REVIEWING
+from anki.consts import MODEL_CLOZE, QUEUE_TYPE_SUSPENDED, REVLOG_RESCHED, \
+    CARD_TYPE_REV as CARD_TYPE_REVIEWING
 from aqt import mw
 from aqt.qt import QAction
 
+from .delaying import Delay, DelayRow, SiblingRow, SIBLING_ROW_COLUMNS
+
 try:
     from anki.utils import html_to_text_line
 except ImportError:
@@ -36,6 +42,10 @@ def is_card_in_a_filtered_deck(card: Card) -> bool:
     return card.odue != 0 and card.odid != 0
 
 
+def get_card_home_deck_id(card: Card) -> int:
+    return card.odid or card.did
+
+
 def get_card_absolute_due(card: Card) -> int:
     return card.odue if is_card_in_a_filtered_deck(card) else card.due
 
@@ -48,26 +58,152 @@ def set_card_absolute_due(card: Card, absolute_due: int):
     card.flush()
 
 
-def remove_card_from_current_review_queue(card: Card):
+# Setting the due of many cards one by one is slow, as each flush is a backend call.
+# This does the same thing as `set_card_absolute_due` for many cards in at most two queries.
+# Receives card id, new absolute due, and whether the card is in a filtered deck.
+def set_cards_absolute_due(rows: Iterable["tuple[int, int, bool]"]):
+    modified = int(time.time())
+    usn = mw.col.usn()
+    due_rows, original_due_rows = [], []
+
+    for card_id, absolute_due, in_filtered_deck in rows:
+        (original_due_rows if in_filtered_deck else due_rows) \
+            .append((absolute_due, modified, usn, card_id))
+
+    if due_rows:
+        mw.col.db.executemany("update cards set due=?, mod=?, usn=? where id=?", due_rows)
+    if original_due_rows:
+        mw.col.db.executemany("update cards set odue=?, mod=?, usn=? where id=?", original_due_rows)
+
+
+# Does the same as `set_cards_absolute_due`, but one card at a time, through the backend.
+# Receives card id and new absolute due.
+def set_cards_absolute_due_via_backend(rows: Iterable["tuple[int, int]"]):
+    for card_id, absolute_due in rows:
+        set_card_absolute_due(mw.col.get_card(card_id), absolute_due)
+
+
+# Moved cards are logged in revlog as manual reschedules, like Anki logs “Set due date”,
+# so that other devices, and anything else that reads revlog, can tell what happened.
+# The interval stays the same. The entries get consecutive ids, that are unique
+# and come after all the existing ones, even if some of these are from the future,
+# and are all inserted in one query. Returns the first and the last id, if any.
+def log_cards_rescheduled(card_ids: Iterable[int]) -> "Optional[tuple[int, int]]":
+    card_ids = list(card_ids)
+    if not card_ids:
+        return None
+
+    last_revlog_id = mw.col.db.scalar("SELECT coalesce(max(id), 0) FROM revlog")
+    first_id = max(int(time.time() * 1000), last_revlog_id + 1)
+    usn = mw.col.usn()
+
+    mw.col.db.executemany(
+        f"""
+            INSERT INTO revlog (id, cid, usn, ease, ivl, lastIvl, factor, time, type)
+            SELECT ?, id, ?, 0, ivl, ivl, factor, 0, {REVLOG_RESCHED}
+            FROM cards WHERE id = ?
+        """,
+        [(first_id + index, usn, card_id) for index, card_id in enumerate(card_ids)],
+    )
+
+    return first_id, first_id + len(card_ids) - 1
+
+
+def remove_card_from_current_review_queue(card_id: int):
     with suppress(AttributeError, ValueError):
-        mw.col.sched._revQueue.remove(card.id)  # noqa
+        mw.col.sched._revQueue.remove(card_id)  # noqa
+
+
+# Most reviews are of notes of types that only ever produce one card, such as Basic,
+# so whether a note type can produce siblings is remembered for each note type.
+# The note of the card being reviewed is usually already loaded by the reviewer.
+note_type_id_to_can_have_siblings: "dict[int, bool]" = {}
+
+def can_have_siblings(card: Card) -> bool:
+    note_type_id = card.note().mid
+    result = note_type_id_to_can_have_siblings.get(note_type_id)
 
+    if result is None:
+        note_type = mw.col.models.get(note_type_id)
+        result = note_type["type"] == MODEL_CLOZE or len(note_type["tmpls"]) > 1
+        note_type_id_to_can_have_siblings[note_type_id] = result
 
-def get_siblings(card: Card) -> Sequence[Card]:
-    card_ids = card.col.db.list("select id from cards where nid=? and id!=?",
-                                card.nid, card.id)
-    return [mw.col.get_card(card_id) for card_id in card_ids]
+    return result
+
+def clear_can_have_siblings_cache():
+    note_type_id_to_can_have_siblings.clear()
+
+
+# Turns delay rows into delays, reading the rest of the card data in one query.
+# The delays are in the same order as the rows.
+def load_delays(delay_rows: Sequence[DelayRow]) -> "list[Delay]":
+    if not delay_rows:
+        return []
+
+    card_ids = "(" + ",".join(str(card_id) for card_id, _, _ in delay_rows) + ")"
+    card_id_to_data = {
+        card_id: (note_id, interval, odid or did, odue != 0 and odid != 0)
+        for card_id, note_id, interval, odue, odid, did in mw.col.db.all(
+            f"select id, nid, ivl, odue, odid, did from cards where id in {card_ids}"
+        )
+    }
+
+    return [
+        Delay(card_id, *card_id_to_data[card_id], old_absolute_due, new_absolute_due)
+        for card_id, old_absolute_due, new_absolute_due in delay_rows
+    ]
+
+
+# See `SiblingRow` in `delaying.py`
+def get_sibling_rows(card_id: int) -> "list[SiblingRow]":
+    return mw.col.db.all(
+        f"select {SIBLING_ROW_COLUMNS} from cards "
+        f"where nid = (select nid from cards where id = ?) and id != ?",
+        card_id, card_id
+    )
+
+
+# Getting the question of a card renders the whole card template,
+# which is rather expensive if all we need is a short label.
+# The labels are cached by card id and note modification time,
+# so that the label changes when the note gets edited.
+QUESTION_CACHE_SIZE = 1000
+
+@lru_cache(maxsize=QUESTION_CACHE_SIZE)
+def get_question_text_line_by_card_id(card_id: int, _note_mod: int) -> str:
+    return html_to_text_line(mw.col.get_card(card_id).question())
+
+def get_question_text_line(card_id: int, note_id: int) -> str:
+    note_mod = mw.col.db.scalar("select mod from notes where id = ?", note_id)
+    return get_question_text_line_by_card_id(card_id, note_mod)
+
+def clear_question_text_line_cache():
+    get_question_text_line_by_card_id.cache_clear()
 
 
 ########################################################################################
 
 
-# A tiny helper for menu items, since type checking is broken there
+# Anki keeps the `user_files` subfolder of an add-on when updating it,
+# so this is the place for anything that should survive restarts and updates
+def get_user_files_path(filename: str) -> str:
+    addon_folder = mw.addonManager.addonsFolder(mw.addonManager.addonFromModule(__name__))
+    user_files_folder = os.path.join(addon_folder, "user_files")
+    os.makedirs(user_files_folder, exist_ok=True)
+    return os.path.join(user_files_folder, filename)
+
+
+# Tiny helpers for menu items, since type checking is broken there
 def checkable(title: str, on_click: Callable[[bool], None]) -> QAction:
     action = QAction(title, mw, checkable=True)  # noqa
     action.triggered.connect(on_click)  # noqa
     return action
 
+def clickable(title: str, on_click: Callable[[], None]) -> QAction:
+    action = QAction(title, mw)  # noqa
+    action.triggered.connect(lambda _checked=False: on_click())  # noqa
+    return action
+
 
 ########################################################################################
 
@@ -97,6 +233,9 @@ def get_collection_genesis_datetime() -> datetime:
     return today_started_at - days_elapsed_since_genesis
 
 
-def epoch_to_anki_days(epoch: float) -> int:
-    delta = datetime.fromtimestamp(epoch) - get_collection_genesis_datetime()
+# Getting genesis asks the backend, so pass it when converting many timestamps
+def epoch_to_anki_days(epoch: float, genesis: datetime = None) -> int:
+    if genesis is None:
+        genesis = get_collection_genesis_datetime()
+    delta = datetime.fromtimestamp(epoch) - genesis
     return delta.days
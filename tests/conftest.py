@@ -119,6 +119,17 @@ def setup(request, session_with_profile_loaded):
     close_all_dialogs_and_wait_for_them_to_run_closing_callbacks()
 
 
+# The delay log of the test, in a temporary folder, without the rows of other tests
+@pytest.fixture
+def empty_delay_log(tmp_path, monkeypatch):
+    from delay_siblings import audit_log
+
+    audit_log.delay_log.close()
+    monkeypatch.setattr(audit_log, "get_user_files_path", lambda filename: str(tmp_path / filename))
+    yield audit_log.delay_log
+    audit_log.delay_log.close()
+
+
 try_with_all_schedulers = pytest.mark.parametrize(
     "setup",
     [2, 3],
@@ -107,8 +107,15 @@ def test_after_sync_that_brings_one_new_review(setup, sync_after_days):
         assert card2_old_due == card2_new_due
 
 
+@pytest.mark.parametrize("mode", ["in process", "as full sync", "in SQL"])
 @try_with_all_schedulers
-def test_addon_reschedules_one_card_after_sync_that_brings_many_new_reviews(setup):
+def test_addon_reschedules_one_card_after_sync_that_brings_many_new_reviews(setup,
+        mode, monkeypatch):
+    if mode == "as full sync":
+        monkeypatch.setattr(setup.delay_siblings, "FULL_SYNC_DIFF_THRESHOLD", 0)
+    elif mode == "in SQL":
+        monkeypatch.setattr(setup.delay_siblings, "SQL_SYNC_DIFF_THRESHOLD", 0)
+
     setup.delay_siblings.config.enabled_for_current_deck = True
 
     with syncing(for_days=20):
@@ -150,3 +157,71 @@ def test_addon_does_not_reschedule_if_user_manually_set_card_due(setup,
 
     card2_new_due = get_card(setup.card2_id).due
     assert card2_old_due == card2_new_due
+
+
+@pytest.mark.parametrize("mode", ["in process", "in SQL"])
+@try_with_all_schedulers
+def test_review_synced_after_local_delay_of_the_same_card_is_not_lost(setup, mode,
+                                                                      monkeypatch):
+    from delay_siblings.applying import write_delays
+    from delay_siblings.tools import load_delays
+
+    if mode == "in SQL":
+        monkeypatch.setattr(setup.delay_siblings, "SQL_SYNC_DIFF_THRESHOLD", 0)
+
+    review_cards_in_0_5_10_days(setup)
+    card1_due, card2_old_due = get_card(setup.card1_id).due, get_card(setup.card2_id).due
+
+    setup.delay_siblings.config.enabled_for_current_deck = True
+
+    # card 1 is moved locally, later than it is reviewed elsewhere
+    with clock_set_forward_by(days=21):
+        write_delays(load_delays([(setup.card1_id, card1_due, card1_due)]), source="batch")
+
+    with syncing(for_days=20):
+        review_card1_in_20_days(setup)
+
+    card2_new_due = get_card(setup.card2_id).due
+    assert card2_new_due > card2_old_due
+
+
+@try_with_all_schedulers
+def test_snapshot_of_sync_that_did_not_finish_is_used_by_next_sync(setup):
+    review_cards_in_0_5_10_days(setup)
+    card2_old_due = get_card(setup.card2_id).due
+
+    setup.delay_siblings.config.enabled_for_current_deck = True
+
+    # this sync brings a new review, but Anki crashes before it finishes
+    gui_hooks.sync_will_start()
+    with reviewing_on_another_device():
+        review_card1_in_20_days(setup)
+
+    with syncing(for_days=20):
+        pass
+
+    card2_new_due = get_card(setup.card2_id).due
+    assert card2_new_due > card2_old_due
+
+
+@try_with_all_schedulers
+def test_snapshot_of_another_collection_is_not_used(setup, monkeypatch):
+    from delay_siblings import snapshot
+    review_cards_in_0_5_10_days(setup)
+    card2_old_due = get_card(setup.card2_id).due
+
+    setup.delay_siblings.config.enabled_for_current_deck = True
+
+    original_get_collection_id = snapshot.get_collection_id
+    monkeypatch.setattr(snapshot, "get_collection_id", lambda: 123)
+    gui_hooks.sync_will_start()
+    monkeypatch.setattr(snapshot, "get_collection_id", original_get_collection_id)
+
+    with reviewing_on_another_device():
+        review_card1_in_20_days(setup)
+
+    with clock_set_forward_by(days=20):
+        gui_hooks.sync_did_finish()
+
+    card2_new_due = get_card(setup.card2_id).due
+    assert card2_old_due == card2_new_due
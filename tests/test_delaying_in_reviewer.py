@@ -2,9 +2,12 @@ import aqt
 import pytest
 
 from tests.conftest import try_with_all_schedulers, review_cards_in_0_5_10_days, \
-    show_answer_of_card1_in_20_days
+    show_answer_of_card1_in_20_days, review_card1_in_20_days
 from tests.tools.collection import (
     EASY,
+    DO_NOT_ANSWER,
+    add_note,
+    do_some_historic_reviews,
     get_card,
     filtered_deck_created,
     show_deck_overview,
@@ -14,6 +17,7 @@ from tests.tools.collection import (
     reviewer_show_question,
     reviewer_show_answer,
     reviewer_answer_card,
+    get_collection,
 )
 
 
@@ -41,6 +45,65 @@ def test_addon_changes_one_card_due_if_enabled(setup):
     assert card2_old_due != card2_new_due
 
 
+@try_with_all_schedulers
+def test_delaying_in_reviewer_keeps_undo(setup):
+    review_cards_in_0_5_10_days(setup)
+    card1_old_due, card2_old_due = get_card(setup.card1_id).due, get_card(setup.card2_id).due
+
+    setup.delay_siblings.config.enabled_for_current_deck = True
+
+    with clock_set_forward_by(days=20):
+        reset_window_to_review_state()
+        reviewer_show_question()
+        undo_before = get_collection().undo_status().undo
+        reviewer_show_answer()
+        undo_after = get_collection().undo_status().undo
+
+    assert (get_card(setup.card1_id).due, get_card(setup.card2_id).due) != \
+           (card1_old_due, card2_old_due)
+    assert undo_before and undo_after == undo_before
+
+
+@pytest.mark.parametrize("at_end_of_session", [False, True],
+                         ids=["after each answer", "at end of session"])
+@try_with_all_schedulers
+def test_answer_can_be_undone_after_leaving_reviewer(setup, at_end_of_session):
+    review_cards_in_0_5_10_days(setup)
+    card1_old_due, card2_old_due = get_card(setup.card1_id).due, get_card(setup.card2_id).due
+
+    setup.delay_siblings.config.enabled_for_current_deck = True
+    setup.delay_siblings.config.delay_at_end_of_session = at_end_of_session
+
+    with clock_set_forward_by(days=20):
+        reset_window_to_review_state()
+        reviewer_show_question()
+        reviewer_show_answer()
+        reviewer_answer_card(EASY)
+        undo_after_answer = get_collection().undo_status().undo
+        show_deck_overview(setup.deck_id)
+        undo_in_overview = get_collection().undo_status().undo
+
+    assert (get_card(setup.card1_id).due, get_card(setup.card2_id).due) != \
+           (card1_old_due, card2_old_due)
+    assert undo_after_answer and undo_in_overview == undo_after_answer
+
+
+@try_with_all_schedulers
+def test_addon_changes_card_due_when_leaving_reviewer_if_delaying_at_end_of_session(setup):
+    review_cards_in_0_5_10_days(setup)
+    card2_old_due = get_card(setup.card2_id).due
+
+    setup.delay_siblings.config.enabled_for_current_deck = True
+    setup.delay_siblings.config.delay_at_end_of_session = True
+
+    review_card1_in_20_days(setup)
+    assert get_card(setup.card2_id).due == card2_old_due
+
+    with clock_set_forward_by(days=20):
+        show_deck_overview(setup.deck_id)
+    assert get_card(setup.card2_id).due != card2_old_due
+
+
 @try_with_all_schedulers
 def test_addon_changes_one_card_due_in_a_filtered_deck(setup):
     review_cards_in_0_5_10_days(setup)
@@ -106,3 +169,23 @@ def test_card_gets_removed_from_review_queue(setup, enabled, expected_state_afte
         reviewer_answer_card(EASY)
 
         assert aqt.mw.state == expected_state_after_answer
+
+
+@try_with_all_schedulers
+def test_related_basic_note_is_delayed_in_reviewer(setup, monkeypatch):
+    from delay_siblings.related_notes import related_notes
+
+    note_ids = [add_note(model_name="Basic", deck_name="test_deck",
+                         fields={"Front": "word", "Back": back}) for back in ["one", "two"]]
+    card_a_id, card_b_id = [get_collection().find_cards(f"nid:{note_id}")[0]
+                            for note_id in note_ids]
+    do_some_historic_reviews({day: {card_a_id: EASY, card_b_id: EASY} for day in [0, 5, 10]})
+    card_b_old_due = get_card(card_b_id).due
+
+    setup.delay_siblings.config.enabled_for_current_deck = True
+    monkeypatch.setitem(setup.delay_siblings.config.data, "related_notes_field", "Front")
+    setup.delay_siblings.sibling_index.invalidate()
+    related_notes.invalidate()
+
+    do_some_historic_reviews({20: {card_a_id: DO_NOT_ANSWER}})
+    assert get_card(card_b_id).due > card_b_old_due
@@ -7,10 +7,18 @@ from aqt.qt import QRect, QItemSelectionModel
 from tests.conftest import (
     try_with_all_schedulers,
     review_cards_in_0_5_10_days,
+    review_card1_in_20_days,
     show_answer_of_card1_in_20_days,
 )
 
-from tests.tools.collection import move_main_window_to_state, get_card
+from tests.tools.collection import (
+    move_main_window_to_state,
+    get_card,
+    get_collection,
+    clock_set_forward_by,
+    add_note,
+)
+from tests.tools.testing import wait, wait_until
 
 
 @pytest.mark.parametrize(
@@ -32,6 +40,27 @@ def test_new_due_range_function(setup, interval, cards_per_note, result):
             .calculate_new_relative_due_range(interval, cards_per_note) == result
 
 
+@pytest.mark.parametrize("interval", [0, 1, 16, 360, 3650, 3651, 10000])
+def test_tabulated_ranges_are_the_same_as_calculated(setup, interval):
+    from delay_siblings.delaying import DelayCurve, calculate_new_relative_due_range
+    curve = DelayCurve(interval_factor=10, exponent=0.5, max_multiplier=2)
+
+    for cards_per_note in [2, 3, 5]:
+        assert calculate_new_relative_due_range(interval, cards_per_note, curve) == \
+               curve.calculate_range(interval, cards_per_note)
+
+
+def test_delay_curve_is_taken_from_config(setup):
+    config = setup.delay_siblings.config
+    config.data[setup.delay_siblings.configuration.DELAY_CURVES] = \
+        {str(setup.deck_id): {"max_multiplier": 2}}
+    config.save_now()
+    config.load()
+
+    assert config.get_delay_curve(setup.deck_id).max_multiplier == 2
+    assert config.get_delay_curve(setup.deck_id + 1).max_multiplier == 1.3
+
+
 @try_with_all_schedulers
 @pytest.mark.parametrize("quiet", [False, True], ids=["not quiet", "quiet"])
 def test_tooltip_not_called_if_quiet(setup, quiet, monkeypatch):
@@ -81,6 +110,38 @@ def test_menus_get_disabled_enabled(setup):
     assert get_menu_status() == (True, True, True, True, False, False)
 
 
+def test_config_writes_are_coalesced(setup, monkeypatch):
+    configuration = setup.delay_siblings.configuration
+    config = setup.delay_siblings.config
+    monkeypatch.setattr(configuration, "save_config", MagicMock())
+
+    config.enabled_for_current_deck = True
+    config.quiet = True
+    config.delay_after_sync = configuration.DO_NOT_DELAY
+    assert configuration.save_config.call_count == 0  # noqa
+
+    wait_until(lambda: configuration.save_config.call_count == 1)  # noqa
+    wait(configuration.SAVE_DELAY_MILLISECONDS / 1000)
+    assert configuration.save_config.call_count == 1  # noqa
+
+
+def test_question_labels_are_cached_until_note_is_edited(setup):
+    from delay_siblings import tools
+    tools.clear_question_text_line_cache()
+    card = get_card(setup.card2_id)
+
+    assert tools.get_question_text_line(card.id, card.nid) == "note1 field2"
+    assert tools.get_question_text_line(card.id, card.nid) == "note1 field2"
+    assert tools.get_question_text_line_by_card_id.cache_info().hits == 1
+
+    with clock_set_forward_by(minutes=1):
+        note = card.note()
+        note["field2"] = "edited field2"
+        get_collection().update_note(note)
+
+    assert tools.get_question_text_line(card.id, card.nid) == "edited field2"
+
+
 def test_epoch_to_anki_days(setup):
     from delay_siblings.tools import get_anki_today, epoch_to_anki_days
     next_day_at = aqt.mw.col.sched._timing_today().next_day_at
@@ -94,6 +155,12 @@ class TestConfigMigration:
         data = {"version": 0}
         setup.delay_siblings.configuration.migrate(data)
 
+    def test_v1_config_migration(self, setup):
+        data = {"version": 1, "enabled_for_decks": {}, "quiet": False,
+                "delay_after_sync": "ask_every_time"}
+        data = setup.delay_siblings.configuration.migrate(data)
+        assert data == setup.delay_siblings.configuration.load_default_config()
+
     def test_v0_changed_config_migration(self, setup):
         data = {"version": 0, "123": {"enabled": False, "quiet": True}}
         setup.delay_siblings.configuration.migrate(data)
@@ -109,12 +176,417 @@ class TestConfigMigration:
         data = setup.delay_siblings.configuration.migrate_data_restoring_default_config_on_error(data)
         assert data == setup.delay_siblings.configuration.load_default_config()
 
+    def test_validation_skipped_if_config_did_not_change(self, setup, monkeypatch):
+        configuration = setup.delay_siblings.configuration
+        data = configuration.load_default_config()
+        configuration.migrate(data)
+
+        monkeypatch.setattr(configuration, "validate_config", MagicMock())
+        configuration.migrate(data)
+        assert configuration.validate_config.call_count == 0  # noqa
+
+        data[configuration.QUIET] = not data[configuration.QUIET]
+        configuration.migrate(data)
+        assert configuration.validate_config.call_count == 1  # noqa
+
+
+def test_delays_are_loaded_with_card_data(setup):
+    from delay_siblings.tools import load_delays
+    card2 = get_card(setup.card2_id)
+
+    [delay] = load_delays([(setup.card2_id, 123, 456)])
+    assert (delay.card_id, delay.note_id, delay.interval, delay.home_deck_id,
+            delay.in_filtered_deck, delay.old_absolute_due, delay.new_absolute_due) == \
+           (card2.id, card2.nid, card2.ivl, setup.deck_id, False, 123, 456)
+    assert not hasattr(delay, "__dict__")
+
+
+@pytest.mark.parametrize("cancel", [False, True], ids=["not cancelled", "cancelled"])
+def test_delays_applied_in_chunks(setup, cancel, monkeypatch):
+    from delay_siblings import applying
+    from delay_siblings.tools import load_delays
+    monkeypatch.setattr(applying, "APPLY_CHUNK_SIZE", 1)
+
+    if cancel:
+        checks = iter([False, True])
+        monkeypatch.setattr(applying.QProgressDialog, "wasCanceled", lambda _: next(checks))
+
+    delays = load_delays([(setup.card1_id, 123, 456), (setup.card2_id, 123, 789)])
+    on_finished = MagicMock()
+    applying.apply_delays_in_chunks(delays, source="batch", on_finished=on_finished)
+    wait_until(lambda: on_finished.call_count == 1)
+
+    applied, cancelled, _elapsed = on_finished.call_args.args
+    assert (applied, cancelled) == ((1, True) if cancel else (2, False))
+    assert get_card(setup.card1_id).due == 456
+    if cancel:
+        assert get_card(setup.card2_id).due != 789
+    else:
+        assert get_card(setup.card2_id).due == 789
+
+
+def test_chunks_are_journaled_as_one_batch_even_if_something_writes_in_between(
+        setup, monkeypatch):
+    from delay_siblings import applying
+    from delay_siblings.journal import journal
+    from delay_siblings.tools import load_delays
+    monkeypatch.setattr(applying, "APPLY_CHUNK_SIZE", 1)
+    journal.clear()
+
+    checks = 0
+
+    def was_canceled(_progress):
+        nonlocal checks
+        checks += 1
+        if checks == 2:
+            assert applying.is_applying()
+            applying.write_delays(load_delays([(setup.card1_id, 456, 999)]), source="batch")
+        return False
+
+    monkeypatch.setattr(applying.QProgressDialog, "wasCanceled", was_canceled)
+
+    delays = load_delays([(setup.card1_id, 123, 456), (setup.card2_id, 123, 789)])
+    on_finished = MagicMock()
+    applying.apply_delays_in_chunks(delays, source="sync", on_finished=on_finished)
+    wait_until(lambda: on_finished.call_count == 1)
+
+    assert not applying.is_applying()
+    assert [(batch.source, len(batch)) for batch in journal.batches] == [("sync", 2), ("batch", 1)]
+
+
+def test_idle_sweep_pass_is_journaled_as_one_batch(setup, monkeypatch):
+    from delay_siblings.journal import journal
+    from delay_siblings.tools import load_delays
+    delay_siblings = setup.delay_siblings
+    journal.clear()
+
+    chunk_delays = iter([
+        load_delays([(setup.card1_id, 123, 456)]),
+        load_delays([(setup.card2_id, 123, 789)]),
+        load_delays([(setup.card1_id, 456, 999)]),
+    ])
+    monkeypatch.setattr(delay_siblings, "calculate_delays_for_notes",
+                        lambda _note_ids: next(chunk_delays))
+
+    delay_siblings.delay_siblings_of_swept_notes([setup.note_id])
+    delay_siblings.delay_siblings_of_swept_notes([setup.note_id])
+    delay_siblings.finish_sweep_batch()
+    delay_siblings.delay_siblings_of_swept_notes([setup.note_id])
+    delay_siblings.finish_sweep_batch()
+
+    assert [len(batch) for batch in journal.batches] == [2, 1]
+
+
+def test_last_batch_is_reverted_except_for_cards_changed_since(setup):
+    from delay_siblings.applying import write_delays, revert_last_batch
+    from delay_siblings.tools import load_delays, set_cards_absolute_due
+    card1_old_due, card2_old_due = get_card(setup.card1_id).due, get_card(setup.card2_id).due
+
+    write_delays(load_delays([(setup.card1_id, card1_old_due, 456),
+                              (setup.card2_id, card2_old_due, 789)]), source="batch")
+    set_cards_absolute_due([(setup.card2_id, 1000, False)])
+
+    assert revert_last_batch() == (1, 1)
+    assert get_card(setup.card1_id).due == card1_old_due
+    assert get_card(setup.card2_id).due == 1000
+
+
+@try_with_all_schedulers
+def test_delays_are_logged_in_revlog_as_manual_reschedules(setup):
+    from anki.consts import REVLOG_RESCHED
+    from delay_siblings.applying import write_delays
+    from delay_siblings.tools import load_delays
+
+    review_cards_in_0_5_10_days(setup)
+    setup.delay_siblings.config.enabled_for_current_deck = True
+    card2 = get_card(setup.card2_id)
+    last_review_id = get_collection().db.scalar("select max(id) from revlog")
+    card2_last_review_id = \
+        get_collection().db.scalar("select max(id) from revlog where cid = ?", card2.id)
+
+    write_delays(load_delays([(card2.id, card2.due, card2.due + 3)]), source="batch")
+
+    assert get_collection().db.all("select cid, ivl, lastIvl, type from revlog where id > ?",
+                                   last_review_id) == \
+           [(card2.id, card2.ivl, card2.ivl, REVLOG_RESCHED)]
+    assert setup.delay_siblings.get_card_id_to_last_review_time(skip_manual=True)[card2.id] \
+           == card2_last_review_id
+
+
+@try_with_all_schedulers
+def test_siblings_are_delayed_after_cards_are_rescheduled_manually(setup):
+    from delay_siblings.reschedules import manual_reschedules
+
+    review_cards_in_0_5_10_days(setup)
+    setup.delay_siblings.config.enabled_for_current_deck = True
+    manual_reschedules.start()
+    card2_old_due = get_card(setup.card2_id).due
+
+    with clock_set_forward_by(days=20):
+        get_collection().sched.set_due_date([setup.card1_id], "1")
+        card1_new_due = get_card(setup.card1_id).due
+        setup.delay_siblings.operation_did_execute(MagicMock(), handler=None)
+
+        assert get_card(setup.card1_id).due == card1_new_due
+        assert get_card(setup.card2_id).due > card2_old_due
+
+        # the add-on's own reschedules don't count
+        card2_new_due = get_card(setup.card2_id).due
+        setup.delay_siblings.operation_did_execute(MagicMock(), handler=None)
+        assert get_card(setup.card2_id).due == card2_new_due
+
+        # but user's reschedules of cards delayed by the add-on still do
+        card1_due = get_card(setup.card1_id).due
+        get_collection().sched.set_due_date([setup.card2_id], "1")
+        setup.delay_siblings.operation_did_execute(MagicMock(), handler=None)
+        assert get_card(setup.card1_id).due > card1_due
+
+    manual_reschedules.stop()
+
+
+def test_delay_log_pages(setup, empty_delay_log, monkeypatch):
+    from delay_siblings import audit_log
+    from delay_siblings.tools import load_delays
+    monkeypatch.setattr(audit_log, "PAGE_SIZE", 2)
+
+    card1, card2 = get_card(setup.card1_id), get_card(setup.card2_id)
+    empty_delay_log.log_delays(load_delays([(card1.id, 1, 2), (card2.id, 3, 4)]), "sync")
+    empty_delay_log.log_delays(load_delays([(card1.id, 5, 6)]), "reviewer")
+
+    newest_page = empty_delay_log.get_page()
+    assert [(row[2], row[4], row[5], row[6]) for row in newest_page] == \
+           [(card1.id, 5, 6, "reviewer"), (card2.id, 3, 4, "sync")]
+
+    older_page = empty_delay_log.get_page(before_id=newest_page[-1][0])
+    assert [(row[2], row[4], row[5], row[6]) for row in older_page] == \
+           [(card1.id, 1, 2, "sync")]
+
+    card2_page = empty_delay_log.get_page(card_id=card2.id)
+    assert [row[0] for row in card2_page] == [newest_page[1][0]]
+
+    assert empty_delay_log.get_path().endswith(f"delay_log.{aqt.mw.pm.name}.sqlite")
+
+
+def test_stats_count_delayed_siblings_per_deck(setup, tmp_path, monkeypatch):
+    import json
+    from delay_siblings import stats
+    from delay_siblings.tools import load_delays
+    monkeypatch.setattr(stats.stats, "profile_to_counts", {})
+    monkeypatch.setattr(stats, "get_user_files_path", lambda filename: str(tmp_path / filename))
+
+    stats.stats.count_delays(load_delays([(setup.card1_id, 1, 2), (setup.card2_id, 3, 4)]))
+    stats.stats.count_delays(load_delays([(setup.card1_id, 5, 6)]))
+
+    [(deck_id, _month, count, _millis_saved)] = stats.stats.get_rows()
+    assert (deck_id, count) == (setup.deck_id, 3)
+
+    # saved without waiting for profile to close
+    wait_until(lambda: (tmp_path / stats.STATS_FILENAME).exists())
+    saved_counts = json.loads((tmp_path / stats.STATS_FILENAME).read_text())
+    assert sum(saved_counts[aqt.mw.pm.name][str(setup.deck_id)].values()) == 3
+
+
+def test_stats_do_not_count_reverted_delays(setup, tmp_path, monkeypatch):
+    from delay_siblings import stats
+    from delay_siblings.applying import write_delays, revert_last_batch
+    from delay_siblings.tools import load_delays
+    monkeypatch.setattr(stats.stats, "profile_to_counts", {})
+    monkeypatch.setattr(stats, "get_user_files_path", lambda filename: str(tmp_path / filename))
+    card1_old_due, card2_old_due = get_card(setup.card1_id).due, get_card(setup.card2_id).due
+
+    write_delays(load_delays([(setup.card1_id, card1_old_due, 456)]), source="batch")
+    write_delays(load_delays([(setup.card1_id, 456, 789),
+                              (setup.card2_id, card2_old_due, 789)]), source="batch")
+    assert [count for _, _, count, _ in stats.stats.get_rows()] == [3]
+
+    assert revert_last_batch() == (2, 0)
+    assert [count for _, _, count, _ in stats.stats.get_rows()] == [1]
+
+
+def test_note_types_that_can_have_siblings_are_told_apart(setup):
+    from delay_siblings.tools import can_have_siblings
+
+    def get_first_card(note_id):
+        return get_card(get_collection().find_cards(query=f"nid:{note_id}")[0])
+
+    basic_note_id = add_note(model_name="Basic", deck_name="test_deck",
+                             fields={"Front": "front", "Back": "back"})
+    cloze_note_id = add_note(model_name="Cloze", deck_name="test_deck",
+                             fields={"Text": "{{c1::cloze}}"})
+
+    assert can_have_siblings(get_card(setup.card1_id)) is True
+    assert can_have_siblings(get_first_card(cloze_note_id)) is True
+    assert can_have_siblings(get_first_card(basic_note_id)) is False
+
+
+@try_with_all_schedulers
+def test_sibling_index_is_kept_current_while_reviewing(setup):
+    from delay_siblings.sibling_index import sibling_index
+    from delay_siblings.tools import get_sibling_rows
+    deck_ids = [str(setup.deck_id)]
+
+    sibling_index.build(deck_ids)
+    review_cards_in_0_5_10_days(setup)
+
+    for card_id in [setup.card1_id, setup.card2_id]:
+        assert sibling_index.deck_ids == deck_ids
+        assert sibling_index.get_sibling_rows(card_id, deck_ids) == \
+               [tuple(row) for row in get_sibling_rows(card_id)]
+
+
+@try_with_all_schedulers
+def test_idle_sweep_delays_siblings_of_notes_reviewed_before_enabling(setup, monkeypatch):
+    from delay_siblings import sweep
+    idle_sweep = setup.delay_siblings.idle_sweep
+    monkeypatch.setattr(idle_sweep, "profile_to_state", {})
+
+    review_cards_in_0_5_10_days(setup)
+    review_card1_in_20_days(setup)
+    card2_old_due = get_card(setup.card2_id).due
+
+    setup.delay_siblings.config.enabled_for_current_deck = True
+
+    with clock_set_forward_by(days=20):
+        move_main_window_to_state("review")
+        assert idle_sweep.tick() is False
+        assert get_card(setup.card2_id).due == card2_old_due
+
+        move_main_window_to_state("overview")
+        monkeypatch.setattr(sweep, "IDLE_AFTER_SECONDS", 3600)
+        idle_sweep.start()
+        assert idle_sweep.tick() is False  # user was active just now
+        assert get_card(setup.card2_id).due == card2_old_due
+
+        monkeypatch.setattr(sweep, "IDLE_AFTER_SECONDS", 0)
+        while not idle_sweep.tick():
+            pass
+        idle_sweep.stop()
+
+    assert get_card(setup.card2_id).due > card2_old_due
+    assert idle_sweep.get_state()["cursor"] == 0
+
+
+@pytest.mark.parametrize("export_format", ["csv", "jsonl"])
+def test_planned_delays_are_exported(setup, export_format):
+    import csv
+    import io
+    import json
+    from delay_siblings.export import export_delays, plan_delays
+
+    review_cards_in_0_5_10_days(setup)
+    review_card1_in_20_days(setup)
+
+    with clock_set_forward_by(days=20):
+        collection = get_collection()
+        file = io.StringIO()
+        export_delays(plan_delays(collection, [setup.deck_id]), file, export_format,
+                      today=collection.sched.today, get_deck_name=collection.decks.name)
+
+    if export_format == "csv":
+        [header, row] = list(csv.reader(io.StringIO(file.getvalue())))
+        record = dict(zip(header, row))
+    else:
+        [line] = file.getvalue().splitlines()
+        record = json.loads(line)
+
+    assert record["deck"] == "test_deck"
+    assert int(record["card"]) == setup.card2_id
+    assert int(record["new_relative_due"]) > int(record["old_relative_due"])
+
+
+def test_planned_delays_are_not_hidden_by_logged_reschedules(setup):
+    from delay_siblings.export import plan_delays
+    from delay_siblings.tools import log_cards_rescheduled
+
+    review_cards_in_0_5_10_days(setup)
+    review_card1_in_20_days(setup)
+
+    with clock_set_forward_by(days=20):
+        log_cards_rescheduled([setup.card2_id])
+        delays = list(plan_delays(get_collection(), [setup.deck_id]))
+
+    assert [delay.card_id for delay in delays] == [setup.card2_id]
+
+
+def test_sibling_collisions_are_counted_and_cached(setup):
+    from delay_siblings.applying import write_delays
+    from delay_siblings.collisions import get_collisions
+    from delay_siblings.tools import load_delays
+    from delay_siblings.delaying import DEFAULT_DELAY_CURVE
+
+    review_cards_in_0_5_10_days(setup)
+
+    collisions = get_collisions(setup.deck_id, DEFAULT_DELAY_CURVE)
+    assert sum(collisions.gap_counts) == 1
+    assert collisions.notes_too_close == 1
+    assert get_collisions(setup.deck_id, DEFAULT_DELAY_CURVE) is collisions
+
+    write_delays(load_delays([(setup.card2_id, get_card(setup.card2_id).due, 10000)]),
+                 source="batch")
+    collisions = get_collisions(setup.deck_id, DEFAULT_DELAY_CURVE)
+    assert collisions.notes_too_close == 0
+
+
+def test_backfill_takes_the_latest_review_of_each_note_in_range(setup, monkeypatch):
+    import time
+    from delay_siblings import backfill
+    monkeypatch.setattr(backfill, "REVLOG_PAGE_SIZE", 1)
+    deck_ids = [str(setup.deck_id)]
+
+    review_cards_in_0_5_10_days(setup)
+    review_card1_in_20_days(setup)
+    last_review_id = get_collection().db.scalar("select max(id) from revlog")
+    in_15_days_millis = int((time.time() + 15 * 86400) * 1000)
+
+    assert backfill.get_card_id_to_last_review_in_range(deck_ids, 0, 2 ** 62) == \
+           {setup.card1_id: last_review_id}
+
+    [(card_id, review_id)] = \
+        backfill.get_card_id_to_last_review_in_range(deck_ids, 0, in_15_days_millis).items()
+    assert card_id in [setup.card1_id, setup.card2_id]
+    assert review_id < last_review_id
+
+
+@try_with_all_schedulers
+def test_backfill_computes_delays_in_background(setup, run_background_tasks_on_main_thread,
+                                                monkeypatch):
+    from datetime import date, timedelta
+    monkeypatch.setattr(setup.delay_siblings, "offer_backfill_delays", MagicMock())
+
+    review_cards_in_0_5_10_days(setup)
+    review_card1_in_20_days(setup)
+    setup.delay_siblings.config.enabled_for_current_deck = True
+
+    with clock_set_forward_by(days=20):
+        setup.delay_siblings.perform_backfill(date.today() - timedelta(days=1), date.today())
+
+    [(delays, *_), _] = setup.delay_siblings.offer_backfill_delays.call_args
+    assert [delay.card_id for delay in delays] == [setup.card2_id]
+
+
+def test_related_notes_are_found_by_normalized_field_value(setup):
+    from delay_siblings.related_notes import related_notes
+    deck_ids = [str(setup.deck_id)]
+    related_notes.invalidate()
+
+    related_note_id = add_note(model_name="test_model", deck_name="test_deck",
+                               fields={"field1": " <b>Note1 Field1</b>", "field2": "other"})
+    assert related_notes.get_related_note_ids(setup.note_id, "field1", deck_ids) == \
+           {related_note_id}
+
+    note = get_collection().get_note(related_note_id)
+    note["field1"] = "something else"
+    get_collection().update_note(note)
+    related_notes.reload_note(related_note_id)
+    assert related_notes.get_related_note_ids(setup.note_id, "field1", deck_ids) == set()
+
 
 def test_opening_browser_from_delay_dialog(setup):
-    from delay_siblings import Delay, DelayAfterSyncDialog
+    from delay_siblings import DelayAfterSyncDialog
+    from delay_siblings.tools import load_delays
 
-    delay = Delay(get_card(setup.card2_id), 123, 456)
-    dialog = DelayAfterSyncDialog(delays=[delay], on_accepted=lambda: None)
+    delays = load_delays([(setup.card2_id, 123, 456)])
+    dialog = DelayAfterSyncDialog(delays=delays, on_accepted=lambda: None)
     dialog.show()
 
     dialog.list.setSelection(QRect(1, 1, 1, 1), QItemSelectionModel.SelectionFlag.Select)
@@ -0,0 +1,102 @@
+# Upper bounds on the number of queries and backend calls the add-on makes.
+# If any of these fail, something got slower; if it's on purpose, raise the bounds.
+
+from aqt import gui_hooks
+
+from tests.conftest import (
+    try_with_all_schedulers,
+    review_cards_in_0_5_10_days,
+    review_card1_in_20_days,
+)
+
+from tests.tools.collection import (
+    get_card,
+    clock_set_forward_by,
+)
+
+
+@try_with_all_schedulers
+def test_show_answer_makes_few_queries(setup):
+    from delay_siblings.instrumentation import counting_collection_access
+
+    review_cards_in_0_5_10_days(setup)
+    setup.delay_siblings.config.enabled_for_current_deck = True
+    setup.delay_siblings.sibling_index.build(setup.delay_siblings.config.enabled_for_deck_ids)
+    card1 = get_card(setup.card1_id)
+    card2_old_due = get_card(setup.card2_id).due
+
+    with clock_set_forward_by(days=20):
+        with counting_collection_access() as counts:
+            gui_hooks.reviewer_did_show_answer(card1)
+
+    assert get_card(setup.card2_id).due > card2_old_due
+    assert counts.queries <= 2  # load delays, get note modification time
+    assert counts.backend_calls <= 4  # get and write the delayed card, render its question
+
+
+@try_with_all_schedulers
+def test_repeated_show_answer_on_the_same_day_makes_no_queries(setup):
+    from delay_siblings.instrumentation import counting_collection_access
+
+    review_cards_in_0_5_10_days(setup)
+    setup.delay_siblings.config.enabled_for_current_deck = True
+    card1, card2 = get_card(setup.card1_id), get_card(setup.card2_id)
+
+    with clock_set_forward_by(days=20):
+        gui_hooks.reviewer_did_show_answer(card1)
+
+        with counting_collection_access() as counts:
+            gui_hooks.reviewer_did_show_answer(card1)
+            gui_hooks.reviewer_did_show_answer(card2)
+
+    assert (counts.queries, counts.backend_calls) == (0, 0)
+
+
+@try_with_all_schedulers
+def test_show_answer_makes_no_queries_if_nothing_to_delay(setup):
+    from delay_siblings.instrumentation import counting_collection_access
+
+    setup.delay_siblings.config.enabled_for_current_deck = True
+    setup.delay_siblings.sibling_index.build(setup.delay_siblings.config.enabled_for_deck_ids)
+    card1 = get_card(setup.card1_id)
+
+    with counting_collection_access() as counts:
+        gui_hooks.reviewer_did_show_answer(card1)
+
+    assert (counts.queries, counts.backend_calls) == (0, 0)
+
+
+@try_with_all_schedulers
+def test_delay_after_sync_makes_few_queries(setup):
+    from delay_siblings.instrumentation import counting_collection_access
+    delay_siblings = setup.delay_siblings
+
+    review_cards_in_0_5_10_days(setup)
+    review_card1_in_20_days(setup)
+    card2_old_due = get_card(setup.card2_id).due
+
+    delay_siblings.config.enabled_for_current_deck = True
+    delay_siblings.config.delay_after_sync = delay_siblings.DELAY_WITHOUT_ASKING
+    delay_siblings.sibling_index.build(delay_siblings.config.enabled_for_deck_ids)
+    after = delay_siblings.get_card_id_to_last_review_time(skip_manual=True)
+
+    with clock_set_forward_by(days=20):
+        with counting_collection_access() as counts:
+            delay_siblings.perform_delay_after_sync(before={}, after=after)
+
+    assert get_card(setup.card2_id).due > card2_old_due
+    assert counts.queries <= 4  # load delays, write them, get last revlog id, log them
+    assert counts.backend_calls == 0
+
+
+def test_writing_delays_makes_three_queries(setup):
+    from delay_siblings.applying import write_delays
+    from delay_siblings.instrumentation import counting_collection_access
+    from delay_siblings.tools import load_delays
+
+    delays = load_delays([(setup.card1_id, 123, 456), (setup.card2_id, 123, 789)])
+
+    with counting_collection_access() as counts:
+        write_delays(delays, source="batch")
+
+    assert (counts.queries, counts.backend_calls) == (3, 0)  # write delays, get last revlog id, log them